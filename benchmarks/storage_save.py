@@ -0,0 +1,62 @@
+"""
+Cost of one `insert_repo` (and `remove_repo`) with the json and the sqlite database
+backends, as the number of installed packages grows. Every synthetic package has
+`files` installed files.
+
+    python benchmarks/storage_save.py [packages] [files]
+"""
+
+import logging as log
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bpm.search import RepoHandler  # noqa: E402
+from bpm.storage import RepoGroup  # noqa: E402
+
+OPS = 20
+
+
+def package(i: int, files: int) -> RepoHandler:
+    name = f"pkg{i:06}"
+    return RepoHandler(name).set(
+        version="v1.0.0",
+        asset=f"https://github.com/owner/{name}/releases/download/v1.0.0/{name}.tar.gz",
+        installed_files=[f"/usr/share/{name}/file{j}" for j in range(files)],
+    )
+
+
+def bench(backend: str, sizes: list[int], files: int):
+    with TemporaryDirectory() as tmp_dir:
+        group = RepoGroup(db_path=Path(tmp_dir) / "db.json", backend=backend)
+        count = 0
+        for size in sizes:
+            # fill up in one save, then time single operations
+            group.repos.extend(package(i, files) for i in range(count, size - OPS))
+            group.repos.sort()
+            group.save()
+            start = time.perf_counter()
+            for i in range(size - OPS, size):
+                group.insert_repo(package(i, files))
+            insert = (time.perf_counter() - start) / OPS
+            start = time.perf_counter()
+            group.remove_repo(f"pkg{size - 1:06}")
+            remove = time.perf_counter() - start
+            group.insert_repo(package(size - 1, files))
+            count = size
+            print(
+                f"{backend:6} {size:6} packages: "
+                f"insert {insert * 1000:8.2f} ms, remove {remove * 1000:8.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    log.disable(log.WARNING)
+    packages = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    sizes = [s for s in (100, 1000, 10000, 100000) if s < packages] + [packages]
+    for backend in ("json", "sqlite"):
+        bench(backend, sizes, files)
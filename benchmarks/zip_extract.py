@@ -0,0 +1,49 @@
+"""
+Extract a synthetic zip of many deflated members with 1 thread and with `threads`
+(default `ZIP_THREADS`, the number of cpus up to 8).
+
+    python benchmarks/zip_extract.py [members] [member KiB] [threads]
+"""
+
+import io
+import random
+import sys
+import time
+import zipfile
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bpm.install.archive import ZIP_THREADS, extract_zip  # noqa: E402
+
+
+def make_zip(members: int, size: int) -> io.BytesIO:
+    rand = random.Random(0)
+    words = [bytes(rand.choices(b"abcdefghijklmnop", k=8)) for _ in range(4096)]
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as z:
+        for i in range(members):
+            content = b" ".join(rand.choices(words, k=size // 9))
+            z.writestr(f"pkg/share/{i % 16}/file{i}", content)
+    return data
+
+
+def bench(data: io.BytesIO, threads: int) -> float:
+    with TemporaryDirectory() as tmp_dir:
+        data.seek(0)
+        start = time.perf_counter()
+        extract_zip(data, Path(tmp_dir), threads)
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    size = (int(sys.argv[2]) if len(sys.argv) > 2 else 256) * 1024
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else ZIP_THREADS
+    data = make_zip(members, size)
+    print(f"{members} members, {len(data.getvalue()) / 2**20:.1f} MiB compressed")
+    single = min(bench(data, 1) for _ in range(3))
+    parallel = min(bench(data, threads) for _ in range(3))
+    print(f"1 thread:   {single:.3f}s")
+    print(f"{threads} threads:  {parallel:.3f}s ({single / parallel:.1f}x)")
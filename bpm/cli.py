@@ -1,7 +1,23 @@
 import argparse
 import sys
 
-from .command import cli_alias, cli_info, cli_install, cli_remove, cli_update
+from .command import (
+    cli_alias,
+    cli_cache,
+    cli_info,
+    cli_install,
+    cli_remove,
+    cli_update,
+)
+
+
+def rate(value) -> int:
+    from .install.download import parse_rate
+
+    try:
+        return parse_rate(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
 def value_in(value, in_list):
@@ -37,7 +53,7 @@ install_parser.add_argument(
     "--local",
     nargs="?",
     metavar="Archive",
-    help="install from local archive.",
+    help="install from local archive. It can also be an asset url, file name or hash in the download cache (see `bpm cache list`).",
 )
 install_parser.add_argument(
     "-q",
@@ -86,6 +102,18 @@ install_parser.add_argument(
     ),
     help="sort param in github api, use `best-match` by default. The value could be `stars`, `forks`, `help-wanted-issues`, `updated`.",
 )
+install_parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    help="number of packages to download and extract at the same time. Use `jobs` in config (4) by default.",
+)
+install_parser.add_argument(
+    "--limit-rate",
+    type=rate,
+    metavar="RATE",
+    help="max total download bandwidth in bytes per second, e.g. `500K` or `2M`, shared by all parallel downloads. Use `limit_rate` in config (unlimited) by default.",
+)
 install_parser.set_defaults(func=cli_install)
 
 
@@ -111,7 +139,19 @@ update_parser.add_argument(
     "--local",
     nargs="?",
     metavar="Archive",
-    help="update from local archive.",
+    help="update from local archive, or an archive in the download cache.",
+)
+update_parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    help="number of packages to check, download and extract at the same time. Use `jobs` in config (4) by default.",
+)
+update_parser.add_argument(
+    "--limit-rate",
+    type=rate,
+    metavar="RATE",
+    help="max total download bandwidth in bytes per second, e.g. `500K` or `2M`, shared by all parallel downloads. Use `limit_rate` in config (unlimited) by default.",
 )
 update_parser.set_defaults(func=cli_update)
 
@@ -128,6 +168,14 @@ alias_parser.add_argument("new_name", help="New name of the bin.")
 alias_parser.add_argument("old_name", help="Old name of the bin.")
 alias_parser.set_defaults(func=cli_alias)
 
+cache_parser = subparsers.add_parser("cache", help="Manage the download cache.")
+cache_parser.add_argument(
+    "action",
+    type=lambda value: value_in(value, ["list", "clear", "stats"]),
+    help="`list` cached archives, `clear` them (and cached api responses), or show hit rate and saved bytes in `stats`.",
+)
+cache_parser.set_defaults(func=cli_cache)
+
 
 def main():
     if len(sys.argv) == 1:
@@ -1,14 +1,15 @@
 import logging as log
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from typing import Iterator, Optional
 from urllib.parse import urlparse
 
-from pretty_assert import assert_
-
-from .install import auto_install, download_and_extract, extract, remove
 from .search import RepoHandler
 from .storage import repo_group
 from .utils import check_root, error_exit, set_dry_run, trace
+from .utils.config import get_config
 from .utils.constants import BIN_PATH, WINDOWS
 from .utils.exceptions import RepoNotFoundError
 
@@ -24,22 +25,147 @@ def parse_name_or_url(name_or_url: str) -> tuple[str, bool]:
     return name_or_url, False
 
 
+def local_archive(local: str) -> tuple[Path, str]:
+    """
+    Resolve the `--local` argument: an archive file, or an asset url, file name or hash
+    prefix of an archive in the download cache.
+    `Returns`: the archive path and its file name.
+    """
+    from .install.cache import open_cache
+
+    path = Path(local)
+    if path.is_file():
+        return path, path.name
+    cache = open_cache()
+    if cache and (blob := cache.find(local)):
+        log.info(f"using cached archive {blob}")
+        return blob, cache.name_of(blob)
+    raise FileNotFoundError(f"`{local}` is neither a file nor in the download cache.")
+
+
+def download_and_prepare(args, repo: RepoHandler) -> tuple[TemporaryDirectory, Path]:
+    """
+    Download (or take `--local`) and extract a package into a new temp dir, on the
+    filesystem of the install destination if possible.
+    The caller cleans the temp dir up after installing.
+
+    `Returns`: the temp dir and the "main" path of extracted files.
+    """
+    from .install import download_and_extract, extract, staging_dir
+    from .install.download import Checksum
+
+    tmp_dir = TemporaryDirectory(dir=staging_dir())
+    try:
+        if args.local:
+            archive, name = local_archive(args.local)
+            with archive.open("rb") as f:
+                main_path = extract(f, Path(tmp_dir.name), name)
+            repo.sha256 = None
+        else:
+            assert repo.asset
+            checksum = Checksum(repo.asset.rpartition("/")[-1], repo.expected_sha256)
+            main_path = download_and_extract(
+                repo.asset, Path(tmp_dir.name), checksum
+            )
+            repo.sha256 = checksum.digest
+    except BaseException:
+        tmp_dir.cleanup()
+        raise
+    return tmp_dir, main_path
+
+
 def download_and_install(args, repo: RepoHandler, rename=True):
+    from .install import auto_install
+
+    tmp_dir, main_path = download_and_prepare(args, repo)
+    with tmp_dir:
+        auto_install(repo, main_path, rename=rename)
+
+
+def get_jobs(args) -> int:
+    """
+    Number of packages handled at the same time.
+    """
+    return max(1, getattr(args, "jobs", None) or int(get_config("jobs")))
+
+
+def resolve_package(args, package: str) -> Optional[RepoHandler]:
+    """
+    Search the repo and the asset of a package.
+    `Returns`: `None` if the package is already installed.
+    """
+    real_name, is_url = parse_name_or_url(package)
+    if not args.dry_run and repo_group.find_repo(real_name)[1]:
+        log.error(f"{real_name} is already installed.")
+        return None
+
     try:
-        with TemporaryDirectory() as tmp_dir:
-            tmp_dir = Path(tmp_dir)
-            if args.local:
-                with Path(args.local).open("rb") as f:
-                    main_path = extract(f, tmp_dir, Path(args.local).name)
-            else:
-                assert repo.asset
-                main_path = download_and_extract(repo.asset, tmp_dir)
-            auto_install(repo, main_path, rename=rename)
+        if is_url:
+            repo = (
+                RepoHandler(
+                    real_name,
+                    prefer_gnu=args.prefer_gnu,
+                    one_bin=args.one_bin,
+                    asset_filter=args.filter,
+                )
+                .set_by_url(package)
+                .with_bin_name(args.bin_name)
+            )
+        else:
+            repo = RepoHandler(
+                package,
+                prefer_gnu=args.prefer_gnu,
+                one_bin=args.one_bin,
+                asset_filter=args.filter,
+            ).with_bin_name(args.bin_name)
+            if not args.local:
+                repo.ask(quiet=args.quiet, sort=args.sort)
+        if not args.local:
+            repo.get_asset(interactive=args.interactive)
     except Exception as e:
-        raise e
+        log.error(f"Failed on searching `{package}`: {e}")
+        trace()
+        exit(1)
+    return repo
+
+
+@contextmanager
+def worker_pool(args) -> Iterator[ThreadPoolExecutor]:
+    """
+    A pool of `--jobs` workers. On Ctrl-C or an error, all running downloads are cancelled.
+    """
+    from .install.download import cancel_downloads, reset_cancel
+
+    pool = ThreadPoolExecutor(max_workers=get_jobs(args))
+    try:
+        yield pool
+    except KeyboardInterrupt:
+        cancel_downloads()
+        log.warning("Keyboard Cancelled")
+        exit(1)
+    except BaseException:
+        # stop the others
+        cancel_downloads()
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        reset_cancel()
+
+
+def rollback(repo: RepoHandler, e: BaseException):
+    from .install import remove
+
+    log.error(f"Failed to install `{repo.name}`: {e}")
+    trace()
+    log.error("Restoring...")
+    remove(repo.file_list)
+    error_exit("Files restored. Exiting...")
 
 
 def cli_install(args):
+    from .install import auto_install
+    from .install.download import set_limit_rate
+
     if args.interactive and args.quiet:
         log.error("Cannot use both --interactive and --quiet.")
         exit(1)
@@ -49,61 +175,54 @@ def cli_install(args):
         set_dry_run()
     else:
         check_root()
+    if args.limit_rate is not None:
+        set_limit_rate(args.limit_rate)
     if args.local and len(args.packages) > 1:
         log.error(
             "Cannot install multiple packages from local. Please install them separately."
         )
         exit(1)
-    for package in args.packages:
-        real_name, is_url = parse_name_or_url(package)
-        if not args.dry_run and repo_group.find_repo(real_name)[1]:
-            log.error(f"{real_name} is already installed.")
-            continue
+    packages = list(dict.fromkeys(args.packages))
 
-        # search
+    def prepare(repo: RepoHandler):
         try:
-            if is_url:
-                repo = (
-                    RepoHandler(
-                        real_name,
-                        prefer_gnu=args.prefer_gnu,
-                        one_bin=args.one_bin,
-                        asset_filter=args.filter,
-                    )
-                    .set_by_url(package)
-                    .with_bin_name(args.bin_name)
-                )
-            else:
-                repo = RepoHandler(
-                    package,
-                    prefer_gnu=args.prefer_gnu,
-                    one_bin=args.one_bin,
-                    asset_filter=args.filter,
-                ).with_bin_name(args.bin_name)
-                if not args.local:
-                    repo.ask(quiet=args.quiet, sort=args.sort)
-            if not args.local:
-                repo.get_asset(interactive=args.interactive)
+            return (repo, *download_and_prepare(args, repo))
         except Exception as e:
-            log.error(f"Failed on searching `{package}`: {e}")
-            trace()
-            exit(1)
+            rollback(repo, e)
 
-        # install
-        try:
-            download_and_install(args, repo)
-            if not args.dry_run:
-                repo_group.insert_repo(repo)
-        except Exception as e:
-            log.error(f"Failed to install `{repo.name}`: {e}")
-            trace()
-            log.error("Restoring...")
-            # rollback.
-            remove(repo.file_list)
-            error_exit("Files restored. Exiting...")
+    def resolve_and_prepare(package: str):
+        repo = resolve_package(args, package)
+        return repo and prepare(repo)
+
+    # Searching, downloading and extracting run in a pool, installing and saving the
+    # database run one by one in the main thread, in the order of the arguments.
+    with worker_pool(args) as pool:
+        # asking the user can not run in parallel, so search one by one first
+        if args.interactive or not (
+            args.quiet or args.local or all(parse_name_or_url(p)[1] for p in packages)
+        ):
+            repos = [resolve_package(args, p) for p in packages]
+            futures = [pool.submit(prepare, r) for r in repos if r]
+        else:
+            futures = [pool.submit(resolve_and_prepare, p) for p in packages]
+
+        for future in futures:
+            prepared = future.result()
+            if not prepared:
+                continue
+            repo, tmp_dir, main_path = prepared
+            with tmp_dir:
+                try:
+                    auto_install(repo, main_path)
+                    if not args.dry_run:
+                        repo_group.insert_repo(repo)
+                except (Exception, KeyboardInterrupt) as e:
+                    rollback(repo, e)
 
 
 def cli_remove(args):
+    from .install import remove
+
     check_root()
     failed = []
     for package in args.packages:
@@ -132,40 +251,72 @@ def cli_remove(args):
 
 
 def cli_update(args):
+    from .install import auto_install
+    from .install.download import set_limit_rate
+    from .search.graphql import batch_releases
+
     check_root()
+    if args.limit_rate is not None:
+        set_limit_rate(args.limit_rate)
     failed = []
 
-    def update(repo: RepoHandler):
+    def check_and_prepare(repo: RepoHandler):
+        """
+        Check for an update, and download and extract it if there is one.
+        `Returns`: `None` if no update, otherwise the new version, the old version and
+        asset for restoring, and the prepared files.
+        """
+        old = (repo.version, repo.asset, repo.sha256)
         try:
-            log.info(f"Updating `{repo.name}`...")
-            result = repo.update_asset()
-            if result:
-                log.info(
-                    f"`{repo.name}` has an update: {result[0]} -> {result[1]}. Updating..."
-                )
-                download_and_install(args, repo, rename=False)
-                repo.version = result[1]
-                log.info(f"`{repo.name}` updated successfully.")
-            else:
+            result = repo.update_asset(releases.get(repo.name))
+            if not result:
                 log.info(f"`{repo.name}` is the newest.")
-        except Exception as e:
-            failed.append(repo.name)
-            log.error(f"Failed to update {repo.name}: {e}")
-            trace()
+                return None
+            log.info(f"`{repo.name}` has an update: {result[0]} -> {result[1]}.")
+            return (result[1], old, *download_and_prepare(args, repo))
+        except BaseException:
+            repo.version, repo.asset, repo.sha256 = old
+            raise
 
     if not args.packages:  # update all
-        num = len(repo_group.repos)
-        for repo in repo_group.repos:
-            update(repo)
+        repos = list(repo_group.repos)
     else:  # update some
-        num = len(args.packages)
+        repos = []
         for name in args.packages:
             _, repo = repo_group.find_repo(name)
             if repo:
-                update(repo)
+                repos.append(repo)
             else:
                 failed.append(name)
                 log.error(f"Package `{name}` not found.")
+    num = len(repos) + len(failed)
+
+    # Update checks, downloads and extractions of all packages run in a pool,
+    # updates are installed one by one in the database order.
+    log.info(f"Checking updates of {len(repos)} packages...")
+    # one graphql query for all packages if a token is configured, the rest use REST
+    releases = batch_releases(repos)
+    with worker_pool(args) as pool:
+        futures = [pool.submit(check_and_prepare, repo) for repo in repos]
+        for repo, future in zip(repos, futures):
+            try:
+                prepared = future.result()
+                if not prepared:
+                    continue
+                new_version, old, tmp_dir, main_path = prepared
+                with tmp_dir:
+                    log.info(f"Updating `{repo.name}`...")
+                    try:
+                        auto_install(repo, main_path, rename=False)
+                    except BaseException:
+                        repo.version, repo.asset, repo.sha256 = old
+                        raise
+                repo.version = new_version
+                log.info(f"`{repo.name}` updated successfully.")
+            except (Exception, SystemExit) as e:
+                failed.append(repo.name)
+                log.error(f"Failed to update {repo.name}: {e}")
+                trace()
     repo_group.save()
 
     log.info(f"Update complete. Total: {num}, Success: {num - len(failed)}")
@@ -176,7 +327,11 @@ def cli_update(args):
 def cli_info(args):
     try:
         if not args.package:
+            from .net import print_quota
+
             repo_group.info_repos()
+            print()
+            print_quota()
         else:
             repo_group.info_one_repo(str(args.package))
     except RepoNotFoundError as e:
@@ -185,6 +340,8 @@ def cli_info(args):
 
 
 def cli_alias(args):
+    from pretty_assert import assert_
+
     assert_(WINDOWS, "Alias command is only supported on Windows.")  # type: ignore
     assert_(
         args.old_name != args.new_name,
@@ -203,3 +360,24 @@ def cli_alias(args):
 
     repo_group.alias_lnk(args.old_name, args.new_name)
     log.info(f"Alias `{args.old_name}` to `{args.new_name}`.")
+
+
+def cli_cache(args):
+    from .install.cache import open_cache
+
+    cache = open_cache()
+    if not cache:
+        error_exit("The download cache is disabled or not accessible.")
+    assert cache
+    if args.action == "list":
+        cache.print_list()
+    elif args.action == "stats":
+        cache.print_stats()
+    elif args.action == "clear":
+        from .net.metadata import open_metadata_cache
+
+        check_root()
+        cache.clear()
+        if metadata_cache := open_metadata_cache():
+            metadata_cache.clear()
+        log.info("Download cache cleared.")
@@ -1,23 +1,43 @@
-import io
 import logging as log
 import os
 import platform
 import shutil
+import stat
 import subprocess
-import tarfile
-import zipfile
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from contextlib import suppress
 from pathlib import Path
-from typing import BinaryIO, Optional, Union
-
-import requests
-import tqdm
+from typing import Optional, Union
 
 import bpm.utils as utils
 
 from ..search import RepoHandler
-from ..utils.constants import APP_PATH, BIN_PATH, CONF_PATH, LINUX, WINDOWS
-from ..utils.exceptions import TarPathTraversalException
+from ..utils.config import get_config
+from ..utils.constants import (
+    APP_PATH,
+    BIN_PATH,
+    CONF_PATH,
+    LINUX,
+    STAGING_PATH,
+    WINDOWS,
+)
+from ..utils.exceptions import ChecksumMismatchError
+from .archive import extract, extract_tar_stream, is_stream_tar
+from .cache import hash_file, open_cache
+from .download import (
+    Checksum,
+    fetch,
+    iter_download,
+    log_buffer_usage,
+    open_partial,
+    probe,
+    should_segment,
+    spooled_buffer,
+    stream_and_extract,
+    tee,
+)
+from .fastcopy import copy_file
+from .index import TreeIndex
 
 
 def rename_old(_path: Path):
@@ -31,15 +51,38 @@ def rename_old_rev(_path: Path):
         log.info(f"restoring {old} -> {_path}")
 
 
+def unchanged(_from: Path, _to: Path) -> bool:
+    """
+    Whether the installed file `_to` has the same content as `_from`. Same size and
+    mtime means unchanged (the mtime is kept on install), the hashes are compared only
+    if the mtime differs.
+    """
+    try:
+        src, dst = _from.stat(), _to.lstat()
+    except OSError:
+        return False
+    if not stat.S_ISREG(dst.st_mode) or src.st_size != dst.st_size:
+        return False
+    if src.st_mtime_ns == dst.st_mtime_ns:
+        return True
+    return hash_file(_from) == hash_file(_to)
+
+
 def install(
     _from: Path,
     _to: Path,
     rename: bool = True,
     mode: Optional[int] = None,
     recorder: Optional[list[str]] = None,
+    move: bool = False,
 ):
     """
     install a file to system.
+
+    `rename`: Whether an existing `_to` is renamed to `*.old`. If not (update), an
+        unchanged `_to` is kept as is.
+    `move`: `_from` is a throwaway file (e.g. in the extraction temp dir), it may be
+        moved.
     """
 
     def record():
@@ -56,17 +99,19 @@ def install(
         log.info(f"mkdir {_from} -> {_to}")
         record()
         return
-    if _to.exists():
-        if rename:
-            rename_old(_to)
-        else:
-            _to.unlink()
+    if not rename and unchanged(_from, _to):
+        log.debug(f"unchanged: {_to}")
+        record()
+        if mode and stat.S_IMODE(_to.stat().st_mode) != mode:
+            _to.chmod(mode)
+        return
+    if rename and _to.exists():
+        rename_old(_to)
 
-    shutil.copy2(_from, _to)
+    # committed by an atomic rename, `_to` is never seen half-written
+    copy_file(_from, _to, move, mode)
     log.info(f"{_from} -> {_to}")
     record()
-    if mode:
-        _to.chmod(mode)
 
 
 def merge_dir(
@@ -74,24 +119,59 @@ def merge_dir(
     _to: Union[Path, str],
     rename: bool = True,
     recorder: Optional[list[str]] = None,
+    move: bool = False,
+    entries: Optional[list[Path]] = None,
 ):
     """
-    Install one dir and all files to another.
+    Install one dir and all files to another. The dirs are created first, then the
+    files are installed by `install_threads` threads. They are recorded in the order of
+    `_from.rglob`, also if some of them fail, so a rollback removes what was installed.
 
     `rename`: Whether the overlap files to be renamed to `*.old`. If rename, the previous `*.old` file will be replaced.
+    `move`: Whether the files of `_from` may be moved instead of copied.
+    `entries`: The content of `_from` in `rglob` order, if already known.
     """
     _from = Path(_from)
     _to = Path(_to)
     _to.mkdir(parents=True, exist_ok=True)
 
-    for src_file in _from.rglob("*"):
+    # list first, the files may be moved away while installing
+    if entries is None:
+        entries = list(_from.rglob("*"))
+    # what every entry records, merged in order at the end
+    records: list[list[str]] = [[] for _ in entries]
+
+    def install_entry(i: int):
         install(
-            src_file,
-            _to / src_file.relative_to(_from),
+            entries[i],
+            _to / entries[i].relative_to(_from),
             rename=rename,
-            recorder=recorder,
+            recorder=records[i],
+            move=move,
         )
 
+    try:
+        # parents come before their children in `rglob`
+        files = []
+        for i, entry in enumerate(entries):
+            if entry.is_dir() and not entry.is_symlink():
+                install_entry(i)
+            else:
+                files.append(i)
+        threads = max(1, min(int(get_config("install_threads")), len(files)))
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = [pool.submit(install_entry, i) for i in files]
+            # stop at the first error, the files being installed are finished
+            for future in wait(futures, return_when=FIRST_EXCEPTION).not_done:
+                future.cancel()
+        for future in futures:
+            if not future.cancelled() and future.exception():
+                raise future.exception()  # type: ignore
+    finally:
+        if recorder is not None:
+            for record in records:
+                recorder.extend(record)
+
 
 def restore(recorder: Optional[list[str]] = None):
     """
@@ -108,6 +188,25 @@ def restore(recorder: Optional[list[str]] = None):
         rename_old_rev(file)
 
 
+def remove_vanished(old: list[str], new: list[str]):
+    """
+    update: remove the files of the old version which are not installed by the new one.
+    Dirs are only removed if empty.
+    """
+    # children sort after their parents, remove them first
+    for file in map(lambda x: Path(x), sorted(set(old) - set(new), reverse=True)):
+        if utils.TEST:
+            log.info(f"dry run: remove {file}")
+            continue
+        if file.is_dir() and not file.is_symlink():
+            with suppress(OSError):
+                file.rmdir()
+                log.info(f"deleting {file}")
+        elif file.exists() or file.is_symlink():
+            file.unlink()
+            log.info(f"deleting {file}")
+
+
 def remove_on_windows(recorder: Optional[list[str]] = None, partial: bool = False):
     """
     Remove a repo on windows.
@@ -153,103 +252,154 @@ def remove(recorder: Optional[list[str]] = None):
         restore(recorder)
 
 
-def check_if_tar_safe(tar_file: tarfile.TarFile) -> bool:
-    """CVE-2007-4559"""
-    all_members = tar_file.getnames()
-    root_dir = Path(all_members[0]).parent.resolve()
-    for member in all_members:
-        if not Path(member).resolve().is_relative_to(root_dir):
-            return False
-    return True
-
-
-def extract(buffer: BinaryIO, to_dir: Path, name: str = "") -> Path:
+def extract_file(file: Path, to_dir: Path, name: str) -> Path:
     """
-    extract tar / zip / 7z to dir.
+    Extract an archive file named `name` to dir.
 
     `Returns`: the "main" path of extracted files.
     """
+    # do not extract .exe and .msi file on windows, give it to installer
+    if WINDOWS and (os.path.splitext(name)[-1] in [".exe", ".msi"]):
+        shutil.copyfile(file, to_dir / name)
+        return to_dir
+    with file.open("rb") as buffer:
+        return extract(buffer=buffer, to_dir=to_dir, name=name)
 
-    log.debug(f"extracting `{name}` to `{to_dir}`")
-    try:
-        if name.endswith(".zip"):
-            with zipfile.ZipFile(buffer, "r") as file:
-                file.extractall(path=to_dir)
-        elif name.endswith(".7z"):
-            try:
-                import py7zr
 
-                py7zr.SevenZipFile(buffer, "r").extractall(path=to_dir)
-            except ImportError:
-                utils.error_exit(
-                    "Cannot extract this file without py7zr module. If you installed bpm with pip, please run `pip install py7zr` to install py7zr, then retry."
-                )
-        else:
-            if ".tar" not in name:
-                log.warning(f"unknown file type: {name}")
-            with tarfile.open(fileobj=buffer, mode="r") as file:
-                if not check_if_tar_safe(file):
-                    raise TarPathTraversalException
-                file.extractall(path=to_dir)
-    except Exception as e:
-        utils.error_exit(f"cannot extract file: {e}")
-
-    temp = list(to_dir.glob("*"))
-    if len(temp) == 1 and temp[0].is_dir():
-        return temp[0]
-    return to_dir
-
-
-def download_and_extract(url: str, to_dir: Path) -> Path:
+def download_and_extract(
+    url: str, to_dir: Path, checksum: Optional[Checksum] = None
+) -> Path:
     """
     Download an archive from url and extract to dir.
 
+    Archives in the download cache are not downloaded again (see `cache_size` in config).
+    Small archives are kept in memory. Large ones are downloaded into `DOWNLOAD_PATH`,
+    so an interrupted download resumes next time, with several connections if the server
+    supports ranges (see `download_segments` in config).
+    Tar archives are extracted while downloading (see `stream_extract` in config).
+
+    `checksum`: the sha256 is computed while downloading and verified against
+        `checksum.expected` before the archive is extracted, or, if it is extracted while
+        downloading, before it leaves `to_dir`. The digest is set on it.
     `Returns`: the "main" path of extracted files.
     """
+    filename = url.strip("/").rpartition("/")[-1]
+    checksum = checksum or Checksum(filename)
+    cache = open_cache()
+    if cache and (cached := cache.get(url)):
+        try:
+            # cached archives are named by their sha256
+            checksum.verify(cached.name)
+            return extract_file(cached, to_dir, filename)
+        except ChecksumMismatchError as e:
+            log.warning(f"{e} Download it again.")
+            cache.remove(url)
+
+    info = probe(url)
+    segments = int(get_config("download_segments")) if should_segment(info) else 1
+    partial = open_partial(url, info)
     try:
-        with requests.get(url, stream=True, timeout=5) as response:
-            response.raise_for_status()
-            # Download the file in chunks and save it to a memory buffer
-            # content-length may be empty, default to 0
-            file_size = int(response.headers.get("Content-Length", 0))
-            bar_size = 1024
-            # fetch 8 KB at a time
-            chunk_size = 8192
-            # how many bars are there in a chunk?
-            chunk_bar_size = chunk_size / bar_size
-            # bars are by KB
-            num_bars = int(file_size / bar_size)
-
-            buffer = io.BytesIO()
-            # noinspection PyTypeChecker
-            with tqdm.tqdm(
-                disable=None,  # disable on non-TTY
-                total=num_bars,
-                unit="KB",
-                desc=url.split("/")[-1],
-            ) as pbar:
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    if chunk:
-                        buffer.write(chunk)
-                        pbar.update(chunk_bar_size)
-
+        # tar archives need no random access, extract them while downloading
+        if get_config("stream_extract") and is_stream_tar(filename):
+            with spooled_buffer() as buffer:
+                if partial:
+                    chunks = partial.iter_chunks(segments)
+                else:
+                    chunks = iter_download(url)
+                    if cache:
+                        # small archive, keep a copy for the cache
+                        chunks = tee(chunks, buffer)
+                try:
+                    main = stream_and_extract(
+                        checksum.wrap(chunks), to_dir, extract_tar_stream
+                    )
+                    checksum.verify()
+                except (SystemExit, ChecksumMismatchError):
+                    # the downloaded bytes are bad, do not resume from them.
+                    _ = partial and partial.remove()
+                    raise
+                if cache:
+                    if partial:
+                        cache.put_file(
+                            url, partial.path, move=True, digest=checksum.digest
+                        )
+                    else:
+                        buffer.seek(0)
+                        cache.put_fileobj(url, buffer, digest=checksum.digest)
+            _ = partial and partial.remove()
+            return main
+
+        if partial:
+            file = partial.download(segments)
+            try:
+                # segments arrive out of order, so the file is hashed once complete
+                checksum.verify(hash_file(file))
+                main = extract_file(file, to_dir, filename)
+                _ = cache and cache.put_file(
+                    url, file, move=True, digest=checksum.digest
+                )
+                return main
+            finally:
+                partial.remove()
+
+        with spooled_buffer() as buffer:
+            size = fetch(url, buffer, checksum)
+            log_buffer_usage(buffer, size)
+            checksum.verify()
             buffer.seek(0)
-            filename = url.strip("/").rpartition("/")[-1]
 
-            # do not extract .exe and .msi file on windows, give it to installer
             if WINDOWS and (os.path.splitext(url)[-1] in [".exe", ".msi"]):
-                file = to_dir / filename
-                file.write_bytes(buffer.getvalue())
-                return to_dir
-            return extract(buffer=buffer, to_dir=to_dir, name=filename)
+                with (to_dir / filename).open("wb") as file:
+                    shutil.copyfileobj(buffer, file)
+                main = to_dir
+            else:
+                main = extract(buffer=buffer, to_dir=to_dir, name=filename)
+            if cache:
+                buffer.seek(0)
+                cache.put_fileobj(url, buffer, digest=checksum.digest)
+            return main
     except KeyboardInterrupt:
-        # suppressed not binding lint
-        with suppress(NameError):
-            pbar.close()  # type: ignore
-        log.warning("Keyboard Cancelled")
+        if partial and partial.resumable:
+            log.warning(
+                f"Keyboard Cancelled. {partial.written} bytes are kept, the download will resume next time."
+            )
+        else:
+            log.warning("Keyboard Cancelled")
         exit(1)
 
 
+def staging_dir(pkgdst: Path = Path("/")) -> Optional[Path]:
+    """
+    The dir to extract packages to: `STAGING_PATH` if it is on the same filesystem as
+    `pkgdst/usr`, so installing renames the files instead of copying them.
+    `None` (the system temp dir) otherwise, or if it is not writable (e.g. dry run as
+    non-root).
+    """
+    if not LINUX:
+        return None
+    pkgdst = Path(pkgdst)
+    usr = pkgdst / "usr" if (pkgdst / "usr").exists() else pkgdst
+    try:
+        STAGING_PATH.mkdir(parents=True, exist_ok=True)
+        if STAGING_PATH.stat().st_dev == usr.stat().st_dev:
+            return STAGING_PATH
+        log.debug(f"{STAGING_PATH} is not on the filesystem of {usr}")
+    except OSError as e:
+        log.debug(f"staging dir disabled: {e}")
+    return None
+
+
+# top level dirs of a package merged into the system
+MERGE_DIRS = {
+    "usr": "usr",
+    "lib": "usr/lib",
+    "include": "usr/include",
+    "share": "usr/share",
+    "bin": "usr/bin",
+    "man": "usr/share/man",
+}
+
+
 def install_on_linux(
     path: Path,
     # TODO: how about using multiple candidate bin_names : list[str] ?
@@ -258,6 +408,7 @@ def install_on_linux(
     rename: bool = True,
     recorder: Optional[list[str]] = None,
     pkgdst=Path("/"),
+    move: bool = False,
 ):
     """
     Install files to a linux system.
@@ -267,13 +418,16 @@ def install_on_linux(
     4. services
 
     `path`: The "main path" dir of files to be installed.
+    `move`: Whether the files of `path` may be moved instead of copied.
     """
     assert LINUX, "Not a linux system"
     pkgdst = Path(pkgdst)
 
     log.debug(f"install_on_linux() with params: {locals()}")
 
-    def install_to(_from: Path, _to: Path, mode: Optional[int] = None):
+    def install_to(
+        _from: Path, _to: Path, mode: Optional[int] = None, move: bool = move
+    ):
         """
         install file to a folder.
         """
@@ -283,6 +437,7 @@ def install_on_linux(
             rename=rename,
             mode=mode,
             recorder=recorder,
+            move=move,
         )
 
     def install_bin(p: Path):
@@ -296,77 +451,78 @@ def install_on_linux(
     def install_service(p: Path):
         """Install service file."""
         with suppress(FileNotFoundError):
-            install_to(p, pkgdst / "usr/lib/systemd/system/", mode=0o644)
+            # copied, it may be merged to the system as well
+            install_to(
+                p, pkgdst / "usr/lib/systemd/system/", mode=0o644, move=False
+            )
 
     def install_completions(path: Path):
         """Install completions from a dir."""
         log.debug(f"installing completions from {path}")
-        if not path.is_dir():
+        if not index.is_dir(path):
             log.warning(f"trying to install {path} as completions: not a directory")
             return
-        with suppress(FileNotFoundError):
-            for file in path.rglob("*.fish"):
+        for file in index.under(path):
+            if index.is_dir(file):
+                continue
+            if file.name.endswith(".fish"):
                 # $fish_complete_path
-                install_to(
-                    file, pkgdst / "usr/share/fish/vendor_completions.d", mode=0o644
-                )
-        with suppress(FileNotFoundError):
-            for file in path.rglob("*.bash"):
-                install_to(
-                    file, pkgdst / "usr/share/bash-completion/completions", mode=0o644
-                )
-        with suppress(FileNotFoundError):
-            for file in path.rglob("_*"):
-                if "zsh" in file.read_text():
-                    install_to(
-                        file, pkgdst / "usr/share/zsh/site-functions", mode=0o644
-                    )
-
-    first_layer: list[Path] = list(path.glob("*"))
+                to = "usr/share/fish/vendor_completions.d"
+            elif file.name.endswith(".bash"):
+                to = "usr/share/bash-completion/completions"
+            elif file.name.startswith("_") and index.is_zsh_completion(file):
+                to = "usr/share/zsh/site-functions"
+            else:
+                continue
+            # skipped if the shell is not installed
+            with suppress(FileNotFoundError):
+                install_to(file, pkgdst / to, mode=0o644)
+
+    # one walk, all the rules below query it
+    index = TreeIndex(path)
+    first_layer: list[Path] = index.children()
     assert first_layer, f"{path} is empty"
 
     # 1. only install one bin
     if one_bin or len(first_layer) == 1:
         # if there is only one file (not dir), assert it's a binary file, whatever the name it is.
-        if len(first_layer) == 1 and first_layer[0].is_file():
+        if len(first_layer) == 1 and not index.is_dir(first_layer[0]):
             bin = first_layer[0]
         else:
-            bin = next(path.rglob(bin_name))
+            bin = index.find_bin(bin_name)
         if bin is not None and bin.is_file():
             log.debug(f"judge out bin: selected {bin}")
             install_bin(bin)
-            bin.unlink()
+            bin.unlink(missing_ok=True)
+            index.remove(bin)
             if one_bin:
                 return
 
-    for file in path.glob("*"):
+    # 4. install service files, before merging moves them
+    for file in index.match("*.service"):
+        install_service(file)
+
+    for file in index.children():
         # 2. merge all files to coordinate position
-        if file.name == "usr":
-            merge_dir(file, pkgdst / "usr", rename=rename, recorder=recorder)
-        elif file.name == "lib":
-            merge_dir(file, pkgdst / "usr/lib", rename=rename, recorder=recorder)
-        elif file.name == "include":
-            merge_dir(file, pkgdst / "usr/include", rename=rename, recorder=recorder)
-        elif file.name == "share":
-            merge_dir(file, pkgdst / "usr/share", rename=rename, recorder=recorder)
-        elif file.name == "bin":
-            merge_dir(file, pkgdst / "usr/bin", rename=rename, recorder=recorder)
-        elif file.name == "man":
-            merge_dir(file, pkgdst / "usr/share/man", rename=rename, recorder=recorder)
+        if file.name in MERGE_DIRS:
+            merge_dir(
+                file,
+                pkgdst / MERGE_DIRS[file.name],
+                rename=rename,
+                recorder=recorder,
+                move=move,
+                entries=index.under(file),
+            )
         # 3. deal with other circumstance.
         else:
             name = file.name
             if name.startswith("complet"):
                 install_completions(file)
-            elif name == bin_name and file.is_file():
+            elif name == bin_name and not index.is_dir(file):
                 install_bin(file)
             else:
                 log.debug(f"cannot match {name}.")
 
-    # 4 install service file
-    for file in path.rglob("*.service"):
-        install_service(file)
-
     # check binary
     if not any(map(lambda x: x.startswith("/usr/bin"), recorder or [])):
         log.warning("No binary file found, please check the release package.")
@@ -509,9 +665,27 @@ def auto_install(
     """
 
     if platform.system() == "Linux":
-        install_on_linux(
-            pkgsrc, repo.bin_name, repo.one_bin, rename, repo.installed_files
-        )
+        if rename:
+            install_on_linux(
+                pkgsrc,
+                repo.bin_name,
+                repo.one_bin,
+                rename,
+                repo.installed_files,
+                move=True,
+            )
+            return
+        # update: unchanged files are kept, the ones gone from the release are removed
+        files: list[str] = []
+        try:
+            install_on_linux(
+                pkgsrc, repo.bin_name, repo.one_bin, rename, files, move=True
+            )
+        except BaseException:
+            repo.installed_files += [f for f in files if f not in repo.installed_files]
+            raise
+        remove_vanished(repo.installed_files, files)
+        repo.installed_files = files
     elif platform.system() == "Windows":
         install_on_windows(repo, pkgsrc)
     else:
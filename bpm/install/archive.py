@@ -0,0 +1,218 @@
+import logging as log
+import os
+import posixpath
+import shutil
+import stat
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+import bpm.utils as utils
+
+from ..utils.exceptions import TarPathTraversalException
+from .decompress import decompressed
+
+# tar archives which can be decompressed and unpacked while downloading.
+STREAM_TAR_SUFFIXES = (
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.xz",
+    ".txz",
+    ".tar.bz2",
+    ".tbz2",
+    ".tar.zst",
+    ".tzst",
+)
+# python >= 3.12 (and security releases before) filter tar members
+EXTRACT_ARGS = {"filter": "fully_trusted"} if hasattr(tarfile, "data_filter") else {}
+# zip members decompressed at the same time, zlib releases the GIL
+ZIP_THREADS = min(8, os.cpu_count() or 1)
+
+
+def is_stream_tar(name: str) -> bool:
+    """
+    Whether the archive can be extracted as a stream (no random access needed).
+    """
+    return name.lower().endswith(STREAM_TAR_SUFFIXES)
+
+
+def normalize(path: str, links: set[str]) -> Optional[str]:
+    """
+    Normalize a relative member path without touching the filesystem.
+
+    `links`: The symlinks extracted so far.
+    `Returns`: `None` if the path goes above the root, or up (`..`) from a symlink,
+        whose real parent is unknown.
+
+    >>> normalize("a/./b/../c", set()), normalize("a/../../c", set())
+    ('a/c', None)
+    """
+    parts: list[str] = []
+    for part in path.split("/"):
+        if part in ("", "."):
+            continue
+        if part == "..":
+            if not parts or "/".join(parts) in links:
+                return None
+            parts.pop()
+        else:
+            parts.append(part)
+    return "/".join(parts)
+
+
+def check_tar_member(member: tarfile.TarInfo, links: set[str]):
+    """
+    CVE-2007-4559: raise `TarPathTraversalException` if extracting `member` would write
+    outside the root dir: absolute paths, `..`, links pointing outside, device nodes.
+    Symlinks are added to `links`.
+    """
+
+    def reject(reason: str):
+        raise TarPathTraversalException(f"unsafe tar member `{member.name}`: {reason}")
+
+    if member.isdev():
+        reject("device node")
+    if member.name.startswith("/") or (name := normalize(member.name, links)) is None:
+        reject("outside of the root dir")
+    if member.issym():
+        target = member.linkname
+        if target.startswith("/") or (
+            normalize(posixpath.join(posixpath.dirname(name), target), links) is None
+        ):
+            reject(f"symlink to {target}")
+        links.add(name)
+    elif member.islnk():
+        # hardlink targets are relative to the root
+        target = member.linkname
+        if target.startswith("/") or normalize(target, links) is None:
+            reject(f"hardlink to {target}")
+
+
+def extract_tar_members(file: tarfile.TarFile, to_dir: Path):
+    """
+    Extract a tar in one pass, every member is checked before it is written.
+    """
+    links: set[str] = set()
+    for member in file:
+        check_tar_member(member, links)
+        # checked above, skip the filters of newer pythons, they resolve every path
+        file.extract(member, path=to_dir, **EXTRACT_ARGS)
+
+
+def zip_member_path(info: zipfile.ZipInfo, to_dir: Path) -> Path:
+    """
+    Where a zip member is extracted to. Raises `TarPathTraversalException` if it is
+    outside of `to_dir`.
+    """
+    name = info.filename.replace("\\", "/")
+    first = name.split("/", 1)[0]
+    if name.startswith("/") or ":" in first or (path := normalize(name, set())) is None:
+        raise TarPathTraversalException(f"unsafe zip member `{info.filename}`")
+    return to_dir / path
+
+
+def restore_zip_attrs(info: zipfile.ZipInfo, path: Path):
+    """
+    Set the unix permissions (if the zip was made on unix) and the mtime of a member.
+    """
+    mode = stat.S_IMODE(info.external_attr >> 16)
+    if info.create_system == 3 and mode:
+        path.chmod(mode)
+    mtime = time.mktime(info.date_time + (0, 0, -1))
+    os.utime(path, (mtime, mtime))
+
+
+def extract_zip(buffer: BinaryIO, to_dir: Path, threads: int = ZIP_THREADS):
+    """
+    Extract a zip, decompressing the members in `threads` threads. The central directory
+    is read once, the dirs are created up front.
+    Symlinks are extracted as files with the link target as content, like `extractall`.
+    """
+    with zipfile.ZipFile(buffer, "r") as file:
+        members = [(info, zip_member_path(info, to_dir)) for info in file.infolist()]
+        dirs = {path for info, path in members if info.is_dir()}
+        dirs.update(path.parent for info, path in members if not info.is_dir())
+        for path in sorted(dirs):
+            path.mkdir(parents=True, exist_ok=True)
+
+        def write(info: zipfile.ZipInfo, path: Path):
+            # every member is read at its own position of the shared file
+            with file.open(info) as src, path.open("wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            restore_zip_attrs(info, path)
+
+        files = [(info, path) for info, path in members if not info.is_dir()]
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            for future in [pool.submit(write, *member) for member in files]:
+                future.result()
+        for info, path in members:
+            if info.is_dir():
+                restore_zip_attrs(info, path)
+
+
+def main_path(to_dir: Path) -> Path:
+    """
+    If all files are extracted into one folder, returns the folder; otherwise returns `to_dir`.
+    """
+    temp = list(to_dir.glob("*"))
+    if len(temp) == 1 and temp[0].is_dir():
+        return temp[0]
+    return to_dir
+
+
+def extract(buffer: BinaryIO, to_dir: Path, name: str = "") -> Path:
+    """
+    extract tar / zip / 7z to dir.
+
+    `Returns`: the "main" path of extracted files.
+    """
+
+    log.debug(f"extracting `{name}` to `{to_dir}`")
+    try:
+        if name.endswith(".zip"):
+            extract_zip(buffer, to_dir)
+        elif name.endswith(".7z"):
+            try:
+                import py7zr
+
+                py7zr.SevenZipFile(buffer, "r").extractall(path=to_dir)
+            except ImportError:
+                utils.error_exit(
+                    "Cannot extract this file without py7zr module. If you installed bpm with pip, please run `pip install py7zr` to install py7zr, then retry."
+                )
+        else:
+            if ".tar" not in name:
+                log.warning(f"unknown file type: {name}")
+            # a stream, the archive is decompressed only once
+            with decompressed(buffer) as stream:
+                with tarfile.open(fileobj=stream, mode="r|") as file:
+                    extract_tar_members(file, to_dir)
+    except Exception as e:
+        utils.error_exit(f"cannot extract file: {e}")
+
+    return main_path(to_dir)
+
+
+def extract_tar_stream(stream: BinaryIO, to_dir: Path) -> Path:
+    """
+    extract a (compressed) tar from a non-seekable stream, member by member.
+    Every member is checked before it is written.
+
+    `Returns`: the "main" path of extracted files.
+    """
+    log.debug(f"stream extracting to `{to_dir}`")
+    try:
+        with decompressed(stream) as tar_stream:
+            with tarfile.open(fileobj=tar_stream, mode="r|") as file:
+                extract_tar_members(file, to_dir)
+    except BrokenPipeError:
+        # the download failed, it reports the error itself
+        raise
+    except Exception as e:
+        utils.error_exit(f"cannot extract file: {e}")
+
+    return main_path(to_dir)
@@ -0,0 +1,258 @@
+import functools
+import hashlib
+import json
+import logging as log
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from ..utils.config import get_config
+from ..utils.constants import CACHE_PATH
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: Path) -> str:
+    """
+    sha256 hex digest of a file.
+    """
+    sha = hashlib.sha256()
+    with path.open("rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class DownloadCache:
+    """
+    Downloaded archives in `CACHE_PATH`, stored by content hash and looked up by asset url.
+    The least recently used archives are evicted once the total size exceeds `max_size`.
+
+    `index.json` maps every url to `{"hash", "size", "name", "last_used"}`, and keeps the
+    hit/miss statistics.
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_size: Optional[int] = None):
+        self.path = Path(path or CACHE_PATH)
+        self.blob_path = self.path / "blobs"
+        self.index_path = self.path / "index.json"
+        self.max_size = (
+            int(get_config("cache_size")) if max_size is None else max_size
+        )
+        self.entries: dict[str, dict] = {}
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+        # downloads may run in several threads
+        self.lock = threading.RLock()
+        self.read()
+
+    def read(self):
+        try:
+            data = json.loads(self.index_path.read_text())
+            self.entries = data["entries"]
+            self.stats.update(data["stats"])
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, UnicodeDecodeError, KeyError) as e:
+            log.warning(f"cache index broken: {e}. use a clean cache instead.")
+        return self
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        temp = self.index_path.with_suffix(".tmp")
+        temp.write_text(json.dumps({"entries": self.entries, "stats": self.stats}))
+        temp.replace(self.index_path)
+
+    def blob(self, digest: str) -> Path:
+        return self.blob_path / digest
+
+    @property
+    def total_size(self) -> int:
+        """
+        Size of all cached archives. Archives shared by several urls count once.
+        """
+        return sum({e["hash"]: e["size"] for e in self.entries.values()}.values())
+
+    def get(self, url: str) -> Optional[Path]:
+        """
+        Returns the cached archive of `url`, or `None` on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry and self.blob(entry["hash"]).is_file():
+                entry["last_used"] = time.time()
+                self.stats["hits"] += 1
+                self.stats["bytes_saved"] += entry["size"]
+                self.save()
+                log.info(f"using cached {entry['name']}")
+                return self.blob(entry["hash"])
+            self.entries.pop(url, None)
+            self.stats["misses"] += 1
+            self.save()
+            return None
+
+    def find(self, key: str) -> Optional[Path]:
+        """
+        Find a cached archive by url, file name or hash prefix, without counting a hit.
+        """
+        with self.lock:
+            for url, entry in sorted(
+                self.entries.items(), key=lambda x: x[1]["last_used"], reverse=True
+            ):
+                if key in (url, entry["name"]) or (
+                    len(key) >= 8 and entry["hash"].startswith(key)
+                ):
+                    blob = self.blob(entry["hash"])
+                    return blob if blob.is_file() else None
+        return None
+
+    def name_of(self, blob: Path) -> str:
+        """
+        The archive file name of a cached blob.
+        """
+        for entry in self.entries.values():
+            if entry["hash"] == blob.name:
+                return entry["name"]
+        return blob.name
+
+    def _add(self, url: str, digest: str, size: int) -> Path:
+        self.entries[url] = {
+            "hash": digest,
+            "size": size,
+            "name": url.strip("/").rpartition("/")[-1],
+            "last_used": time.time(),
+        }
+        self.evict(keep=url)
+        self.save()
+        log.debug(f"cached {url} as {digest}")
+        return self.blob(digest)
+
+    def put_file(
+        self, url: str, file: Path, move: bool = False, digest: Optional[str] = None
+    ) -> Path:
+        """
+        Store a downloaded file. `move` it into the cache instead of copying if it's no longer needed.
+        `digest`: the sha256 of the file if already known, so it is not read again.
+
+        `Returns`: the path of the cached archive.
+        """
+        with self.lock:
+            digest = digest or hash_file(file)
+            blob = self.blob(digest)
+            self.blob_path.mkdir(parents=True, exist_ok=True)
+            if not blob.exists():
+                if move:
+                    shutil.move(file, blob)
+                else:
+                    shutil.copyfile(file, blob)
+            return self._add(url, digest, blob.stat().st_size)
+
+    def put_fileobj(
+        self, url: str, fileobj: BinaryIO, digest: Optional[str] = None
+    ) -> Path:
+        """
+        Store a downloaded file object from its current position.
+        `digest`: the sha256 of the content if already known, so it is not hashed again.
+
+        `Returns`: the path of the cached archive.
+        """
+        with self.lock:
+            self.blob_path.mkdir(parents=True, exist_ok=True)
+            sha = hashlib.sha256()
+            temp = self.blob_path / f".{threading.get_ident()}.tmp"
+            with temp.open("wb") as file:
+                while chunk := fileobj.read(HASH_CHUNK_SIZE):
+                    if not digest:
+                        sha.update(chunk)
+                    file.write(chunk)
+            digest = digest or sha.hexdigest()
+            temp.replace(self.blob(digest))
+            return self._add(url, digest, self.blob(digest).stat().st_size)
+
+    def remove(self, url: str):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry and not any(
+                e["hash"] == entry["hash"] for e in self.entries.values()
+            ):
+                self.blob(entry["hash"]).unlink(missing_ok=True)
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        Remove the least recently used archives until the cache fits in `max_size`.
+        `keep` is never evicted, even if it alone is larger than `max_size`.
+        """
+        with self.lock:
+            for url in sorted(self.entries, key=lambda u: self.entries[u]["last_used"]):
+                if self.total_size <= self.max_size:
+                    break
+                if url == keep:
+                    continue
+                log.debug(f"evicting {url} from cache")
+                self.remove(url)
+
+    def clear(self):
+        with self.lock:
+            shutil.rmtree(self.blob_path, ignore_errors=True)
+            self.entries.clear()
+            self.save()
+
+    def print_list(self):
+        print("{:14} {:>10} {:20} {}".format("Hash", "Size", "Last used", "Url"))
+        for url, entry in sorted(
+            self.entries.items(), key=lambda x: x[1]["last_used"], reverse=True
+        ):
+            print(
+                "{:14} {:>10} {:20} {}".format(
+                    entry["hash"][:12],
+                    format_size(entry["size"]),
+                    time.strftime(
+                        "%Y-%m-%d %H:%M:%S", time.localtime(entry["last_used"])
+                    ),
+                    url,
+                )
+            )
+
+    def print_stats(self):
+        hits, misses = self.stats["hits"], self.stats["misses"]
+        total = hits + misses
+        print(f"cache path:  {self.path}")
+        print(f"archives:    {len(self.entries)}")
+        print(
+            f"size:        {format_size(self.total_size)} / {format_size(self.max_size)}"
+        )
+        print(
+            f"hit rate:    {hits}/{total} ({hits / total:.1%})"
+            if total
+            else "hit rate:    -"
+        )
+        print(f"bytes saved: {format_size(self.stats['bytes_saved'])}")
+
+
+def format_size(size: float) -> str:
+    """
+    >>> format_size(1536)
+    '1.5 KB'
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+@functools.lru_cache()
+def open_cache() -> Optional[DownloadCache]:
+    """
+    The download cache, or `None` if disabled (`cache_size` is 0) or `CACHE_PATH`
+    is not writable (e.g. dry run as non-root).
+    """
+    if int(get_config("cache_size")) <= 0:
+        return None
+    try:
+        CACHE_PATH.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        log.debug(f"download cache disabled: {e}")
+        return None
+    return DownloadCache()
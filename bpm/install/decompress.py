@@ -0,0 +1,187 @@
+"""
+Decompression of tar archives. The format is told by the magic bytes, not the file name,
+and a multithreaded external decoder (`xz -T0`, `pigz`, `zstd -T0`) is used if one is on
+PATH. Otherwise the stdlib codec is used; zstd has none before python 3.14, it needs the
+`zstd` command.
+"""
+
+import bz2
+import functools
+import gzip
+import io
+import logging as log
+import lzma
+import shutil
+import subprocess
+import threading
+from contextlib import contextmanager, suppress
+from typing import BinaryIO, Callable, Iterator, NamedTuple, Optional
+
+from ..utils.config import get_config
+
+# bytes fed to an external decoder at once
+FEED_SIZE = 64 * 1024
+
+
+def zstd_file(file: BinaryIO) -> BinaryIO:
+    from compression.zstd import ZstdFile  # type: ignore  # python >= 3.14
+
+    return ZstdFile(file)
+
+
+class Backend(NamedTuple):
+    name: str
+    magic: bytes
+    # external decoders writing to stdout, the first one on PATH is used
+    commands: tuple[tuple[str, ...], ...]
+    stdlib: Optional[Callable[[BinaryIO], BinaryIO]] = None
+
+
+BACKENDS: list[Backend] = [
+    Backend(
+        "gzip",
+        b"\x1f\x8b",
+        (("pigz", "-dc"),),
+        lambda f: gzip.GzipFile(fileobj=f, mode="rb"),  # type: ignore
+    ),
+    Backend("xz", b"\xfd7zXZ\x00", (("xz", "-dc", "-T0"),), lzma.LZMAFile),
+    Backend("bzip2", b"BZh", (("lbzip2", "-dc"), ("pbzip2", "-dc")), bz2.BZ2File),
+    Backend("zstd", b"\x28\xb5\x2f\xfd", (("zstd", "-dc", "-T0"),), zstd_file),
+]
+MAGIC_SIZE = max(len(b.magic) for b in BACKENDS)
+
+
+def register(backend: Backend):
+    """
+    Add a backend, it is tried before the others.
+    """
+    BACKENDS.insert(0, backend)
+    find_command.cache_clear()
+
+
+def detect(header: bytes) -> Optional[Backend]:
+    """
+    The backend of the compressed data starting with `header`, `None` if it is not
+    compressed (or unknown).
+
+    >>> detect(b"\\xfd7zXZ\\x00\\x00").name
+    'xz'
+    """
+    return next((b for b in BACKENDS if header.startswith(b.magic)), None)
+
+
+@functools.lru_cache()
+def find_command(backend: Backend) -> Optional[list[str]]:
+    for command in backend.commands:
+        if path := shutil.which(command[0]):
+            return [path, *command[1:]]
+    return None
+
+
+class Prefixed(io.RawIOBase):
+    """
+    `head` followed by the rest of `stream`.
+    """
+
+    def __init__(self, head: bytes, stream: BinaryIO):
+        super().__init__()
+        self.head = head
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self.head:
+            n = min(len(b), len(self.head))
+            b[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        data = self.stream.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+
+def read_header(stream: BinaryIO) -> bytes:
+    header = b""
+    while len(header) < MAGIC_SIZE and (data := stream.read(MAGIC_SIZE - len(header))):
+        header += data
+    return header
+
+
+@contextmanager
+def external(command: list[str], stream: BinaryIO) -> Iterator[BinaryIO]:
+    """
+    Decompress `stream` with an external decoder, fed by a thread.
+    The output is read to the end on exit, so the decoder checks the whole archive.
+    """
+    log.debug(f"decompressing with {command}")
+    proc = subprocess.Popen(
+        command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert proc.stdin and proc.stdout and proc.stderr
+    errors: list[BaseException] = []
+
+    def feed():
+        try:
+            while data := stream.read(FEED_SIZE):
+                try:
+                    proc.stdin.write(data)  # type: ignore
+                except BrokenPipeError:
+                    # the decoder exited, its return code tells why
+                    return
+        except BaseException as e:
+            # e.g. the download failed
+            errors.append(e)
+        finally:
+            with suppress(OSError):
+                proc.stdin.close()  # type: ignore
+
+    thread = threading.Thread(target=feed, daemon=True)
+    thread.start()
+    try:
+        yield proc.stdout  # type: ignore
+        while proc.stdout.read(FEED_SIZE):
+            pass
+    except BaseException:
+        proc.kill()
+        thread.join()
+        proc.wait()
+        if errors:
+            raise errors[0]
+        raise
+    thread.join()
+    stderr = proc.stderr.read().decode(errors="replace").strip()
+    if proc.wait() != 0:
+        raise OSError(f"{command[0]} failed: {stderr}")
+    if errors:
+        raise errors[0]
+
+
+@contextmanager
+def decompressed(stream: BinaryIO) -> Iterator[BinaryIO]:
+    """
+    The decompressed content of `stream`, which may be non-seekable. Data not compressed
+    in a known format is passed through.
+    """
+    header = read_header(stream)
+    source = io.BufferedReader(Prefixed(header, stream))  # type: ignore
+    backend = detect(header)
+    if backend is None:
+        yield source  # type: ignore
+        return
+    command = find_command(backend) if get_config("external_decoders") else None
+    if command:
+        with external(command, source) as output:  # type: ignore
+            yield output
+        return
+    try:
+        opened = backend.stdlib(source) if backend.stdlib else None  # type: ignore
+    except ImportError:
+        opened = None
+    if opened is None:
+        names = " or ".join(f"`{c[0]}`" for c in backend.commands)
+        raise OSError(f"cannot decompress {backend.name}, please install {names}.")
+    log.debug(f"decompressing {backend.name} with python")
+    with opened:
+        yield opened
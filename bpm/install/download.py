@@ -0,0 +1,705 @@
+import functools
+import hashlib
+import io
+import json
+import logging as log
+import queue
+import sys
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextlib import suppress
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Callable, Iterable, Iterator, NamedTuple, Optional
+
+import requests
+import tqdm
+
+from .. import net
+from ..net.ratelimit import TokenBucket
+from ..utils.config import get_config, load_config
+from ..utils.constants import DOWNLOAD_PATH
+from ..utils.exceptions import (
+    ChecksumMismatchError,
+    IncompleteDownloadError,
+    RangeNotSupportedError,
+)
+
+# fetch 8 KB at a time
+CHUNK_SIZE = 8192
+
+# set on Ctrl-C, so downloads running in worker threads stop at their next chunk.
+CANCEL = threading.Event()
+
+
+def cancel_downloads():
+    CANCEL.set()
+
+
+def reset_cancel():
+    """
+    Allow downloads again, after all cancelled workers have stopped.
+    """
+    CANCEL.clear()
+
+
+def check_cancelled():
+    """
+    Raise `KeyboardInterrupt` in a worker thread if all downloads are cancelled.
+    """
+    if CANCEL.is_set():
+        raise KeyboardInterrupt
+
+
+def parse_rate(value) -> int:
+    """
+    Parse a bandwidth like `500K` or `2M` (bytes per second, 1024 based).
+
+    >>> parse_rate("1.5M")
+    1572864
+    """
+    value = str(value).strip().upper().removesuffix("B")
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(float(value))
+    except ValueError:
+        raise ValueError(f"invalid rate: `{value}`, use e.g. `500K` or `2M`")
+
+
+@functools.lru_cache()
+def bandwidth() -> TokenBucket:
+    """
+    The bandwidth of all downloads of the process, `limit_rate` bytes per second.
+    Every download takes its chunks from this one bucket, so parallel downloads and
+    segments share the limit instead of multiplying it.
+    """
+    rate = parse_rate(get_config("limit_rate"))
+    # allow a burst of at most a quarter second, so the rate is smooth
+    return TokenBucket(rate, capacity=max(rate / 4, CHUNK_SIZE))
+
+
+def set_limit_rate(rate: int):
+    """
+    Override `limit_rate` for this run (`--limit-rate`).
+    """
+    load_config()["limit_rate"] = rate
+    bandwidth.cache_clear()
+
+
+def throttle(size: int):
+    """
+    Wait until `size` more bytes may be downloaded.
+    """
+    bandwidth().take(size)
+
+
+class Checksum:
+    """
+    sha256 of a download, computed on the way, and compared with the `expected` one
+    (the one published in the release, if any).
+    """
+
+    def __init__(self, name: str = "", expected: Optional[str] = None):
+        self.name = name
+        self.expected = expected.lower() if expected else None
+        self.sha = hashlib.sha256()
+        self.digest: Optional[str] = None
+
+    def wrap(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Hash the chunks while passing them through.
+        """
+        for chunk in chunks:
+            self.sha.update(chunk)
+            yield chunk
+
+    def verify(self, digest: Optional[str] = None) -> str:
+        """
+        Finish with the hash of the wrapped chunks, or a `digest` computed elsewhere.
+
+        Raises `ChecksumMismatchError` if it does not match the expected one.
+        `Returns`: the digest.
+        """
+        self.digest = digest or self.sha.hexdigest()
+        if self.expected and self.digest != self.expected:
+            raise ChecksumMismatchError(self.name, self.expected, self.digest)
+        if self.expected:
+            log.info(f"sha256 of {self.name} verified")
+        return self.digest
+
+
+class RemoteInfo(NamedTuple):
+    """
+    What the server tells about an asset before downloading it.
+    """
+
+    size: int = 0
+    accept_ranges: bool = False
+    etag: str = ""
+
+
+def spooled_buffer(threshold: Optional[int] = None) -> SpooledTemporaryFile:
+    """
+    A buffer which stays in memory for small downloads, and moves to a temp file
+    once more than `threshold` bytes are written.
+
+    `threshold`: use `spool_threshold` in config by default.
+    """
+    if threshold is None:
+        threshold = int(get_config("spool_threshold"))
+    return SpooledTemporaryFile(max_size=threshold)
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Peak resident set size of this process in bytes. `None` if not available (Windows).
+    """
+    with suppress(ImportError):
+        import resource
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # linux reports KB, macos reports bytes
+        return rss if sys.platform == "darwin" else rss * 1024
+    return None
+
+
+def log_buffer_usage(buffer: SpooledTemporaryFile, size: int):
+    """
+    Report where the downloaded bytes were kept and the peak memory, in debug mode.
+    """
+    if not log.getLogger().isEnabledFor(log.DEBUG):
+        return
+    threshold = buffer._max_size  # type: ignore
+    rolled = size > threshold
+    in_memory = min(size, threshold)
+    rss = peak_rss()
+    log.debug(
+        f"downloaded {size} bytes, "
+        f"{'spooled to disk' if rolled else 'kept in memory'}, "
+        f"peak buffer memory: {in_memory} bytes, "
+        f"peak rss: {rss if rss is not None else 'unknown'} bytes"
+    )
+
+
+def progress_bar(url: str, total: int, initial: int = 0) -> tqdm.tqdm:
+    # noinspection PyTypeChecker
+    return tqdm.tqdm(
+        disable=None,  # disable on non-TTY
+        total=total,
+        initial=initial,
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+        desc=url.split("/")[-1],
+    )
+
+
+def iter_download(url: str) -> Iterator[bytes]:
+    """
+    Download `url` in one stream and yield the chunks, with a progress bar.
+    """
+    with net.get(url, "download", stream=True) as response:
+        response.raise_for_status()
+        # content-length may be empty, default to 0
+        file_size = int(response.headers.get("Content-Length", 0))
+        with progress_bar(url, file_size) as pbar:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                check_cancelled()
+                if chunk:
+                    throttle(len(chunk))
+                    pbar.update(len(chunk))
+                    yield chunk
+
+
+def fetch(url: str, buffer: BinaryIO, checksum: Optional[Checksum] = None) -> int:
+    """
+    Download `url` into `buffer` in chunks, with a progress bar.
+    The chunks are hashed on the way into `checksum`, if given.
+
+    `Returns`: the number of bytes written.
+    """
+    chunks = iter_download(url)
+    if checksum:
+        chunks = checksum.wrap(chunks)
+    size = 0
+    for chunk in chunks:
+        buffer.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def tee(chunks: Iterable[bytes], buffer: BinaryIO) -> Iterator[bytes]:
+    """
+    Yield `chunks` and write a copy of them to `buffer`.
+    """
+    for chunk in chunks:
+        buffer.write(chunk)
+        yield chunk
+
+
+class StreamPipe(io.RawIOBase):
+    """
+    A bounded in-memory pipe between two threads.
+    The downloader `write()`s chunks, the extractor `read()`s them as a non-seekable file.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        super().__init__()
+        # at most `maxsize` chunks (2 MB by default) wait in memory
+        self._queue: queue.Queue[Optional[bytes]] = queue.Queue(maxsize)
+        self._chunk = b""
+        self._pos = 0
+        self._eof = False
+        self.aborted = False
+        self.reader_done = False
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while self._pos >= len(self._chunk):
+            if self._eof:
+                return 0
+            try:
+                chunk = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.aborted:
+                    raise BrokenPipeError("download aborted")
+                continue
+            if chunk is None:
+                self._eof = True
+                return 0
+            self._chunk, self._pos = chunk, 0
+        n = min(len(b), len(self._chunk) - self._pos)
+        b[:n] = self._chunk[self._pos : self._pos + n]
+        self._pos += n
+        return n
+
+    def _put(self, item: Optional[bytes]):
+        while True:
+            if self.aborted:
+                raise BrokenPipeError("extraction aborted")
+            if self.reader_done:
+                # the extractor has finished, drop the rest (tar padding, etc.)
+                return
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, chunk) -> int:  # type: ignore
+        self._put(bytes(chunk))
+        return len(chunk)
+
+    def finish(self):
+        """
+        Mark the end of the stream.
+        """
+        self._put(None)
+
+    def abort(self):
+        self.aborted = True
+
+
+def stream_and_extract(
+    chunks: Iterable[bytes], to_dir: Path, extractor: Callable[[BinaryIO, Path], Path]
+) -> Path:
+    """
+    Feed downloaded `chunks` to `extractor` in another thread while downloading,
+    so network I/O and decompression overlap.
+
+    `Returns`: the result of `extractor`.
+    """
+    pipe = StreamPipe()
+    result: dict = {}
+
+    def worker():
+        try:
+            result["path"] = extractor(pipe, to_dir)  # type: ignore
+        except BaseException as e:
+            result["error"] = e
+            # stop the download as well
+            pipe.abort()
+        finally:
+            pipe.reader_done = True
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        size = 0
+        for chunk in chunks:
+            pipe.write(chunk)
+            size += len(chunk)
+        pipe.finish()
+        log.debug(f"streamed {size} bytes")
+    except BaseException as e:
+        pipe.abort()
+        thread.join()
+        # the extractor failed first, its error is the cause, not the broken pipe
+        if isinstance(e, BrokenPipeError) and "error" in result:
+            raise result["error"]
+        raise
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["path"]
+
+
+def probe(url: str) -> RemoteInfo:
+    """
+    Ask the server about `url` without downloading it.
+    Returns an empty `RemoteInfo` if the server does not answer.
+    """
+    with suppress(requests.RequestException, ConnectionError, ValueError):
+        with net.head(url, allow_redirects=True) as response:
+            response.raise_for_status()
+            return RemoteInfo(
+                size=int(response.headers.get("Content-Length", 0)),
+                accept_ranges=response.headers.get("Accept-Ranges", "").lower()
+                == "bytes",
+                etag=response.headers.get("ETag", ""),
+            )
+    return RemoteInfo()
+
+
+def split_ranges(size: int, segments: int) -> list[tuple[int, int]]:
+    """
+    Split `size` bytes into at most `segments` inclusive byte ranges.
+
+    >>> split_ranges(10, 3)
+    [(0, 3), (4, 7), (8, 9)]
+    """
+    step = -(-size // segments)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+def should_segment(info: RemoteInfo) -> bool:
+    """
+    Whether the asset is worth downloading in segments.
+    """
+    return (
+        info.accept_ranges
+        and int(get_config("download_segments")) > 1
+        and info.size >= int(get_config("segment_min_size"))
+    )
+
+
+def fetch_segments(
+    url: str,
+    path: Path,
+    segments: list[list[int]],
+    size: int,
+    etag: str = "",
+    progress: Optional[threading.Condition] = None,
+    stop: Optional[threading.Event] = None,
+):
+    """
+    Download the missing part of every `[start, end, written]` segment of `url` into the
+    preallocated `path` concurrently, each segment through its own handle.
+    `written` is updated in place, so the segments can be saved and resumed after an error.
+
+    `progress`: held while `written` is updated, and notified after.
+    `stop`: set to stop all segments at their next chunk.
+    Raises `RangeNotSupportedError` if the server answers a range request with the whole file.
+    """
+    lock = progress or threading.Condition()
+    cancelled = threading.Event()
+    todo = [s for s in segments if s[0] + s[2] <= s[1]]
+    if not todo:
+        return
+    log.debug(f"downloading {url} in {len(todo)} segments")
+
+    with progress_bar(url, size, initial=sum(s[2] for s in segments)) as pbar:
+
+        def fetch_segment(segment: list[int]):
+            start, end, written = segment
+            headers = {}
+            # the whole file needs no range
+            if start + written != 0 or end != size - 1:
+                headers["Range"] = f"bytes={start + written}-{end}"
+                if etag:
+                    # if the asset has changed, the server sends the whole new file
+                    headers["If-Range"] = etag
+            with net.get(url, "download", headers=headers, stream=True) as response:
+                response.raise_for_status()
+                if headers and response.status_code != 206:
+                    raise RangeNotSupportedError(url)
+                with path.open("r+b") as file:
+                    file.seek(start + written)
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        check_cancelled()
+                        if cancelled.is_set() or (stop and stop.is_set()):
+                            return
+                        if chunk:
+                            chunk = chunk[: end + 1 - start - segment[2]]
+                            throttle(len(chunk))
+                            file.write(chunk)
+                            with lock:
+                                segment[2] += len(chunk)
+                                pbar.update(len(chunk))
+                                lock.notify_all()
+
+        pool = ThreadPoolExecutor(max_workers=len(todo))
+        try:
+            futures = [pool.submit(fetch_segment, s) for s in todo]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+        finally:
+            # on error or Ctrl-C, let the other segments stop at their next chunk
+            cancelled.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+class PartialDownload:
+    """
+    A download kept in `DOWNLOAD_PATH`, so that it can be resumed after an interrupt or timeout.
+
+    The file is keyed by the asset url, its ETag and size, so a changed asset never resumes
+    from stale bytes. The `.json` state beside it records how much of every segment is done.
+    """
+
+    def __init__(self, url: str, info: RemoteInfo):
+        self.url = url
+        self.info = info
+        url_key = hashlib.sha256(url.encode()).hexdigest()[:16]
+        version = hashlib.sha256(f"{info.etag}\n{info.size}".encode()).hexdigest()[:16]
+        self.path = DOWNLOAD_PATH / f"{url_key}-{version}.part"
+        self.state_path = self.path.with_suffix(".json")
+        self.segments: list[list[int]] = self._load_state() or []
+
+    @property
+    def resumable(self) -> bool:
+        return self.info.accept_ranges and self.info.size > 0
+
+    @property
+    def written(self) -> int:
+        return sum(s[2] for s in self.segments)
+
+    def _load_state(self) -> Optional[list[list[int]]]:
+        if not self.resumable or not self.path.exists():
+            return None
+        with suppress(FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+            state = json.loads(self.state_path.read_text())
+            if state["url"] == self.url and state["size"] == self.info.size:
+                log.info(f"resuming download of {self.url}")
+                return state["segments"]
+        return None
+
+    def save_state(self):
+        if not self.path.exists():
+            return
+        self.state_path.write_text(
+            json.dumps(
+                {"url": self.url, "size": self.info.size, "segments": self.segments}
+            )
+        )
+
+    def _prepare(self, segments: int):
+        """
+        Create the part file if there is no resumable state, and remove stale versions.
+        """
+        DOWNLOAD_PATH.mkdir(parents=True, exist_ok=True)
+        url_key = self.path.name.partition("-")[0]
+        for stale in DOWNLOAD_PATH.glob(f"{url_key}-*"):
+            if stale not in (self.path, self.state_path):
+                log.debug(f"removing stale partial download {stale}")
+                stale.unlink(missing_ok=True)
+        if self.segments:
+            return
+        with self.path.open("wb") as file:
+            file.truncate(self.info.size)
+        self.segments = [
+            [start, end, 0] for start, end in split_ranges(self.info.size, segments)
+        ]
+        self.save_state()
+
+    def validate(self):
+        """
+        Raise `IncompleteDownloadError` if the file is not fully downloaded.
+        """
+        size = self.path.stat().st_size
+        if self.written != self.info.size or size != self.info.size:
+            raise IncompleteDownloadError(self.url, self.written, self.info.size)
+
+    def download(self, segments: int = 1) -> Path:
+        """
+        Download the rest of the file with `segments` concurrent connections, and validate it.
+
+        `Returns`: the path of the complete file.
+        """
+        self._prepare(segments)
+        try:
+            fetch_segments(
+                self.url, self.path, self.segments, self.info.size, self.info.etag
+            )
+        except RangeNotSupportedError as e:
+            log.debug(f"{e}, restart in a single stream")
+            self.segments = [[0, self.info.size - 1, 0]]
+            fetch_segments(self.url, self.path, self.segments, self.info.size)
+        finally:
+            self.save_state()
+        self.validate()
+        return self.path
+
+    def iter_chunks(self, segments: int = 1) -> Iterator[bytes]:
+        """
+        Yield the whole file in order while it is downloaded with `segments` connections.
+        """
+        self._prepare(segments)
+        if len(self.segments) == 1:
+            yield from self._iter_stream()
+        else:
+            yield from self._iter_segments()
+        self.validate()
+
+    def _iter_stream(self) -> Iterator[bytes]:
+        """
+        First the bytes already on disk, then the rest from the server, which is
+        appended to the part file on the way.
+        """
+        segment = self.segments[0]
+        try:
+            with self.path.open("r+b") as file:
+                remaining = segment[2]
+                while remaining > 0:
+                    chunk = file.read(min(CHUNK_SIZE * 16, remaining))
+                    remaining -= len(chunk)
+                    yield chunk
+                headers = {}
+                if segment[2]:
+                    headers["Range"] = f"bytes={segment[2]}-"
+                    if self.info.etag:
+                        headers["If-Range"] = self.info.etag
+                with net.get(
+                    self.url, "download", headers=headers, stream=True
+                ) as response:
+                    response.raise_for_status()
+                    if headers and response.status_code != 206:
+                        raise RangeNotSupportedError(self.url)
+                    with progress_bar(
+                        self.url, self.info.size, initial=segment[2]
+                    ) as pbar:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            check_cancelled()
+                            if chunk:
+                                throttle(len(chunk))
+                                file.write(chunk)
+                                segment[2] += len(chunk)
+                                pbar.update(len(chunk))
+                                yield chunk
+        finally:
+            self.save_state()
+
+    def _iter_segments(self) -> Iterator[bytes]:
+        """
+        All segments are downloaded in the background, the file is read back in order
+        as far as it is written, so a tar archive is extracted while its later segments
+        still arrive.
+        If the server does not support ranges after all, the download restarts in a
+        single stream unless some bytes are already yielded.
+        """
+        progress = threading.Condition()
+        stop = threading.Event()
+        errors: list[BaseException] = []
+        finished = threading.Event()
+        # bytes handed to the reader, which must not change any more
+        claimed = 0
+
+        def fetch():
+            try:
+                try:
+                    fetch_segments(
+                        self.url,
+                        self.path,
+                        self.segments,
+                        self.info.size,
+                        self.info.etag,
+                        progress,
+                        stop,
+                    )
+                except RangeNotSupportedError as e:
+                    with progress:
+                        if claimed:
+                            raise
+                        log.debug(f"{e}, restart in a single stream")
+                        self.segments = [[0, self.info.size - 1, 0]]
+                    fetch_segments(
+                        self.url,
+                        self.path,
+                        self.segments,
+                        self.info.size,
+                        progress=progress,
+                        stop=stop,
+                    )
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                with progress:
+                    finished.set()
+                    progress.notify_all()
+
+        thread = threading.Thread(target=fetch, daemon=True)
+        thread.start()
+        try:
+            with self.path.open("rb") as file:
+                offset = 0
+                while offset < self.info.size:
+                    with progress:
+                        while (end := self.written_from(offset)) <= offset:
+                            if finished.is_set():
+                                if errors:
+                                    raise errors[0]
+                                raise IncompleteDownloadError(
+                                    self.url, self.written, self.info.size
+                                )
+                            progress.wait()
+                        claimed = end
+                    file.seek(offset)
+                    while offset < end:
+                        chunk = file.read(min(CHUNK_SIZE * 16, end - offset))
+                        offset += len(chunk)
+                        yield chunk
+            thread.join()
+            if errors:
+                raise errors[0]
+        finally:
+            stop.set()
+            thread.join()
+            self.save_state()
+
+    def written_from(self, offset: int) -> int:
+        """
+        The end of the bytes already written from `offset` in its segment.
+        """
+        for start, end, written in self.segments:
+            if start <= offset <= end:
+                return start + written
+        return offset
+
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+        self.state_path.unlink(missing_ok=True)
+
+
+def open_partial(url: str, info: RemoteInfo) -> Optional[PartialDownload]:
+    """
+    Returns a `PartialDownload` for large assets and assets downloaded in segments, or
+    `None` if the asset is small enough to be kept in memory, has unknown size, or
+    `DOWNLOAD_PATH` is not writable (e.g. dry run as non-root).
+    """
+    if info.size <= int(get_config("spool_threshold")) and not should_segment(info):
+        return None
+    try:
+        DOWNLOAD_PATH.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        log.debug(f"cannot keep partial downloads in {DOWNLOAD_PATH}: {e}")
+        return None
+    return PartialDownload(url, info)
@@ -0,0 +1,110 @@
+"""
+Copy installed files the fastest way the filesystems allow: rename a throwaway source on
+the same filesystem, clone it (reflink on btrfs, xfs), copy it in the kernel with
+`copy_file_range`, or fall back to `shutil.copy2`. A copy is written next to the
+destination and renamed over it, so a reader never sees a half-written file.
+What a (src fs, dst fs) pair does not support is remembered, so it is tried only once.
+"""
+
+import errno
+import logging as log
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+# ioctl request of linux/fs.h: clone all blocks of a file
+FICLONE = 0x40049409
+# errors meaning a strategy is not supported between two filesystems
+UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EBADF,
+}
+
+# (src device, dst device) -> strategies failed between them
+_unsupported: dict[tuple[int, int], set[str]] = {}
+_lock = threading.Lock()
+
+
+def rename(src: Path, dst: Path):
+    os.replace(src, dst)
+
+
+def reflink(src: Path, dst: Path):
+    import fcntl
+
+    with src.open("rb") as fsrc, dst.open("wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def copy_range(src: Path, dst: Path):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    with src.open("rb") as fsrc, dst.open("wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        # the file may grow while copying, copy until the end anyway
+        while n := os.copy_file_range(
+            fsrc.fileno(), fdst.fileno(), max(size - copied, 1 << 30)
+        ):
+            copied += n
+        # some filesystems copy nothing instead of failing
+        if copied < size:
+            raise OSError(errno.EINVAL, f"copied {copied} of {size} bytes")
+    shutil.copystat(src, dst)
+
+
+def strategies(move: bool) -> list[tuple[str, Callable[[Path, Path], None]]]:
+    fast = [("reflink", reflink), ("copy_file_range", copy_range)]
+    return [("rename", rename), *fast] if move else fast
+
+
+def copy_file(
+    src: Path, dst: Path, move: bool = False, mode: Optional[int] = None
+) -> str:
+    """
+    Copy `src` to `dst` with its metadata like `shutil.copy2`, replacing `dst` at once.
+
+    `move`: `src` is a throwaway file, it may be moved away. Symlinks are always copied.
+    `mode`: set before `dst` appears.
+    `Returns`: the strategy used.
+    """
+    move = move and not src.is_symlink()
+    pair = (src.stat().st_dev, dst.parent.stat().st_dev)
+    with _lock:
+        failed = _unsupported.setdefault(pair, set())
+    temp = dst.with_name(f".{dst.name}.{threading.get_ident()}.tmp")
+    try:
+        for name, strategy in strategies(move):
+            if name in failed:
+                continue
+            target = dst if name == "rename" else temp
+            try:
+                if mode and target == dst:
+                    src.chmod(mode)
+                strategy(src, target)
+            except OSError as e:
+                if e.errno not in UNSUPPORTED:
+                    raise
+                log.debug(f"{name} not supported from {src} to {dst}: {e}")
+                with _lock:
+                    failed.add(name)
+                continue
+            break
+        else:
+            name, target = "copy", temp
+            shutil.copy2(src, temp)
+        if target == temp:
+            if mode:
+                temp.chmod(mode)
+            os.replace(temp, dst)
+    finally:
+        temp.unlink(missing_ok=True)
+    log.debug(f"{name}: {src} -> {dst}")
+    return name
@@ -0,0 +1,99 @@
+"""
+An index of an extracted package, built by one walk over it, so the install rules query
+it instead of scanning the tree again for every rule. What a file is, is told by its
+first `HEADER_SIZE` bytes, it is never read as a whole.
+"""
+
+import fnmatch
+import os
+from pathlib import Path
+from typing import Optional
+
+HEADER_SIZE = 512
+
+ELF_MAGIC = b"\x7fELF"
+
+
+class TreeIndex:
+    """
+    Files and dirs under `root`, in the order of `root.rglob("*")`: the content of a dir
+    comes after the dir itself.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.entries: list[Path] = []
+        self.dirs: set[Path] = set()
+        self.headers: dict[Path, bytes] = {}
+        self.walk(self.root)
+
+    def walk(self, top: Path):
+        with os.scandir(top) as it:
+            children = list(it)
+        subdirs = []
+        for entry in children:
+            path = Path(entry.path)
+            self.entries.append(path)
+            if entry.is_dir(follow_symlinks=False):
+                self.dirs.add(path)
+                subdirs.append(path)
+        for subdir in subdirs:
+            self.walk(subdir)
+
+    def is_dir(self, path: Path) -> bool:
+        return path in self.dirs
+
+    def children(self, path: Optional[Path] = None) -> list[Path]:
+        """
+        The entries right in `path` (default: `root`).
+        """
+        path = path or self.root
+        return [p for p in self.entries if p.parent == path]
+
+    def under(self, path: Path) -> list[Path]:
+        """
+        All entries in `path` and its subdirs.
+        """
+        return [p for p in self.entries if path in p.parents]
+
+    def match(self, pattern: str, path: Optional[Path] = None) -> list[Path]:
+        """
+        The entries in `path` (default: `root`) and its subdirs with the name matching
+        the glob `pattern`, like `path.rglob(pattern)`.
+        """
+        entries = self.under(path) if path else self.entries
+        return [p for p in entries if fnmatch.fnmatchcase(p.name, pattern)]
+
+    def remove(self, path: Path):
+        """
+        `path` has been moved or deleted.
+        """
+        self.entries = [p for p in self.entries if p != path and path not in p.parents]
+        self.dirs = {p for p in self.dirs if p != path and path not in p.parents}
+
+    def header(self, path: Path) -> bytes:
+        if path not in self.headers:
+            try:
+                with path.open("rb") as f:
+                    self.headers[path] = f.read(HEADER_SIZE)
+            except OSError:
+                self.headers[path] = b""
+        return self.headers[path]
+
+    def is_executable(self, path: Path) -> bool:
+        """
+        An ELF binary or a script with a shebang.
+        """
+        header = self.header(path)
+        return header.startswith(ELF_MAGIC) or header.startswith(b"#!")
+
+    def is_zsh_completion(self, path: Path) -> bool:
+        header = self.header(path)
+        return header.startswith(b"#compdef") or b"zsh" in header
+
+    def find_bin(self, name: str) -> Optional[Path]:
+        """
+        The file named `name` (a glob), executables first.
+        """
+        files = [p for p in self.match(name) if not self.is_dir(p)]
+        return max(files, key=self.is_executable, default=None)
@@ -0,0 +1,268 @@
+"""
+The one HTTP layer of bpm: a process-wide pooled session with per-stage timeouts,
+retries with exponential backoff, a per-host circuit breaker, mirrors with failover,
+github api rate limiting, and a persistent cache of api responses.
+"""
+
+import functools
+import logging as log
+import threading
+import time
+from typing import Literal, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ..utils.config import get_config
+from ..utils.exceptions import CircuitOpenError
+from .metadata import open_metadata_cache
+from .mirror import measure, mirrors
+from .ratelimit import RATE_LIMIT_URL, Quota, github_tokens, limiter, mask, resource_of
+
+# `api`: small json responses from the github api; `download`: release assets.
+Stage = Literal["api", "download"]
+
+RETRY_STATUS = (500, 502, 503, 504)
+# rejected by the github rate limit this many times in a row, give the response to the caller
+RATE_LIMIT_RETRIES = 5
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a host after `threshold` consecutive failures, for `cooldown` seconds.
+    After the cooldown, one trial request is let through: success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures: dict[str, int] = {}
+        self.opened_at: dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def check(self, host: str):
+        """
+        Raise `CircuitOpenError` if requests to `host` should not be sent now.
+        """
+        with self.lock:
+            opened_at = self.opened_at.get(host)
+            if opened_at is None:
+                return
+            if time.monotonic() - opened_at < self.cooldown:
+                raise CircuitOpenError(host)
+            # half open: let this request through, hold the others for another cooldown.
+            self.opened_at[host] = time.monotonic()
+
+    def success(self, host: str):
+        with self.lock:
+            self.failures.pop(host, None)
+            self.opened_at.pop(host, None)
+
+    def failure(self, host: str):
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= self.threshold:
+                if host not in self.opened_at:
+                    log.warning(
+                        f"{host} failed {self.failures[host]} times in a row, pausing requests to it for {self.cooldown:.0f}s."
+                    )
+                self.opened_at[host] = time.monotonic()
+
+    def reset(self):
+        with self.lock:
+            self.failures.clear()
+            self.opened_at.clear()
+
+
+breaker = CircuitBreaker()
+
+
+@functools.lru_cache()
+def session() -> requests.Session:
+    """
+    The shared session. Connections are kept alive in one pool per host.
+    Idempotent requests are retried on connection errors and 5xx with exponential backoff.
+    """
+    retry = Retry(
+        total=int(get_config("http_retries")),
+        backoff_factor=float(get_config("http_backoff")),
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        # return the last 5xx response instead of raising, callers handle the status
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+def timeout(stage: Stage) -> tuple[float, float]:
+    """
+    (connect, read) timeout of a stage.
+    """
+    return (
+        float(get_config("connect_timeout")),
+        float(get_config(f"{stage}_timeout")),
+    )
+
+
+def request(
+    method: str, url: str, stage: Stage = "api", **kwargs
+) -> requests.Response:
+    """
+    Send a request through the shared session.
+    `timeout` defaults to the timeout of `stage`.
+
+    `api` requests are paced and authenticated by the rate limiter, and wait for the
+    quota to reset instead of failing with 403.
+
+    Raises `CircuitOpenError` if the host has failed too many times recently,
+    `RateLimitError` if the github api quota resets later than `rate_limit_wait`.
+    """
+    kwargs.setdefault("timeout", timeout(stage))
+    resource = resource_of(url) if stage == "api" else None
+    if resource is None:
+        return send(method, url, **kwargs)
+
+    rate_limiter = limiter()
+    for _ in range(RATE_LIMIT_RETRIES):
+        token = rate_limiter.acquire(resource, token_required=resource == "graphql")
+        headers = dict(kwargs.get("headers") or {})
+        if token:
+            headers.setdefault("Authorization", f"bearer {token}")
+        response = send(method, url, **{**kwargs, "headers": headers})
+        if not rate_limiter.update(token, resource, response):
+            break
+        log.debug(f"rate limited: {url}")
+    return response
+
+
+def send(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request to the fastest mirror of `url`, falling back to the next mirror if
+    it fails. The response of the last one is returned as is.
+    """
+    candidates = mirrors().candidates(url, probe_mirror)
+    for i, candidate in enumerate(candidates):
+        last = i == len(candidates) - 1
+        mirror_kwargs = kwargs
+        if candidate != url:
+            log.debug(f"using mirror: {candidate}")
+            # github tokens are not sent to mirrors
+            headers = {
+                k: v
+                for k, v in (kwargs.get("headers") or {}).items()
+                if k.lower() != "authorization"
+            }
+            mirror_kwargs = {**kwargs, "headers": headers}
+        try:
+            response = send_to(method, candidate, **mirror_kwargs)
+        except (requests.ConnectionError, requests.Timeout, ConnectionError):
+            if last:
+                raise
+            mirrors().failed(candidate)
+            continue
+        if response.status_code >= 400 and not last:
+            response.close()
+            mirrors().failed(candidate)
+            continue
+        return response
+    raise AssertionError("unreachable")
+
+
+def probe_mirror(url: str) -> Optional[float]:
+    return measure(
+        functools.partial(send_to, "GET", timeout=timeout("api")),
+        url,
+    )
+
+
+def send_to(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request through the circuit breaker.
+    """
+    host = urlparse(url).netloc
+    breaker.check(host)
+    try:
+        response = session().request(method, url, **kwargs)
+    except (requests.ConnectionError, requests.Timeout):
+        breaker.failure(host)
+        raise
+    if response.status_code in RETRY_STATUS:
+        breaker.failure(host)
+    else:
+        breaker.success(host)
+    return response
+
+
+def get(url: str, stage: Stage = "api", **kwargs) -> requests.Response:
+    return request("GET", url, stage, **kwargs)
+
+
+def head(url: str, stage: Stage = "download", **kwargs) -> requests.Response:
+    return request("HEAD", url, stage, **kwargs)
+
+
+def get_cached(
+    url: str, params: Optional[dict] = None, ttl: Optional[float] = None, **kwargs
+) -> requests.Response:
+    """
+    GET an api response through the metadata cache.
+    A cached response younger than `ttl` seconds (`metadata_ttl` by default) is returned
+    without a request.
+    An older one is revalidated with `If-None-Match` / `If-Modified-Since`: github answers
+    304 if nothing changed, which does not count against the rate limit.
+    """
+    cache = open_metadata_cache()
+    if cache is None:
+        return get(url, params=params, **kwargs)
+    key = cache.key(url, params)
+    entry = cache.get(key)
+    headers = dict(kwargs.pop("headers", None) or {})
+    if entry:
+        if ttl is None:
+            ttl = float(get_config("metadata_ttl"))
+        if time.time() - entry["time"] < ttl:
+            log.debug(f"fresh cached response of {entry['url']}")
+            return cache.response(entry)
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = get(url, params=params, headers=headers, **kwargs)
+    if response.status_code == 304 and entry:
+        log.debug(f"not modified: {entry['url']}")
+        cache.refresh(key, entry)
+        return cache.response(entry)
+    if response.status_code == 200:
+        cache.put(key, response)
+    return response
+
+
+def print_quota():
+    """
+    Print the current github api quota of every token, queried from the free `rate_limit` api.
+    """
+    rate_limiter = limiter()
+    for token in rate_limiter.tokens:
+        headers = {"Authorization": f"bearer {token}"} if token else {}
+        try:
+            r = get(RATE_LIMIT_URL, headers=headers)
+            r.raise_for_status()
+            resources = r.json()["resources"]
+        except (requests.RequestException, ConnectionError, ValueError, KeyError) as e:
+            log.warning(f"cannot get the github api quota of {mask(token)}: {e}")
+            continue
+        print(f"GitHub api quota ({mask(token)}):")
+        for resource in ("core", "search", "graphql"):
+            if resource in resources:
+                r = resources[resource]
+                quota = Quota(r["limit"], r["remaining"], r["reset"])
+                rate_limiter.record(token, resource, quota)
+                print(f"  {resource:8} {quota}")
@@ -0,0 +1,104 @@
+import functools
+import hashlib
+import json
+import logging as log
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from ..utils.constants import METADATA_CACHE_PATH
+
+
+class MetadataCache:
+    """
+    Api responses (search results, release lists) in `METADATA_CACHE_PATH`, one json file
+    per request: `{"url", "etag", "last_modified", "time", "body"}`.
+    The validators are sent back with the next request, so an unchanged answer is a 304.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path or METADATA_CACHE_PATH)
+
+    @staticmethod
+    def key(url: str, params: Optional[dict] = None) -> str:
+        if params:
+            url += "?" + urlencode(sorted(params.items()))
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads((self.path / f"{key}.json").read_text())
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            log.debug(f"broken metadata cache entry {key}: {e}")
+            return None
+
+    def save(self, key: str, entry: dict):
+        self.path.mkdir(parents=True, exist_ok=True)
+        # several threads may save the same entry
+        temp = self.path / f".{key}.{threading.get_ident()}.tmp"
+        temp.write_text(json.dumps(entry))
+        temp.replace(self.path / f"{key}.json")
+
+    def put(self, key: str, response: requests.Response) -> dict:
+        """
+        Store a 200 response with its validators.
+        """
+        entry = {
+            "url": response.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "time": time.time(),
+            "body": response.text,
+        }
+        self.save(key, entry)
+        return entry
+
+    def refresh(self, key: str, entry: dict):
+        """
+        The server confirmed (304) that the entry is still up to date.
+        """
+        entry["time"] = time.time()
+        self.save(key, entry)
+
+    @staticmethod
+    def response(entry: dict) -> requests.Response:
+        """
+        Rebuild the 200 response of a cached entry.
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry["url"]
+        response.encoding = "utf-8"
+        response._content = entry["body"].encode("utf-8")
+        response.headers = CaseInsensitiveDict(
+            {"Content-Type": "application/json; charset=utf-8"}
+        )
+        if entry["etag"]:
+            response.headers["ETag"] = entry["etag"]
+        if entry["last_modified"]:
+            response.headers["Last-Modified"] = entry["last_modified"]
+        return response
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@functools.lru_cache()
+def open_metadata_cache() -> Optional[MetadataCache]:
+    """
+    The metadata cache, or `None` if `METADATA_CACHE_PATH` is not writable (e.g. dry run as non-root).
+    """
+    try:
+        METADATA_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        log.debug(f"metadata cache disabled: {e}")
+        return None
+    return MetadataCache()
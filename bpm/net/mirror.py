@@ -0,0 +1,159 @@
+"""
+Mirrors of github: a url starting with a configured prefix can be fetched from any of
+its mirrors. The mirrors are probed and ranked by speed once in a while, and a request
+falls back to the next mirror if one fails.
+
+Config `mirrors` maps a prefix to mirror prefixes, e.g.
+`{"https://github.com/": ["https://mirror.example.com/github.com/"]}`.
+The original prefix is always a candidate too.
+"""
+
+import functools
+import json
+import logging as log
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+import requests
+
+from ..utils.config import get_config
+from ..utils.constants import MIRROR_RANKING_PATH
+
+# bytes downloaded from every mirror to measure its speed
+PROBE_SIZE = 64 * 1024
+
+
+class Mirrors:
+    """
+    Ranks the mirrors of every rule, and keeps the ranking in `path` for `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        rules: dict[str, list[str]],
+        ttl: float = 3600,
+        path: Optional[Path] = None,
+    ):
+        self.rules = {
+            prefix: list(dict.fromkeys([*mirrors, prefix]))
+            for prefix, mirrors in rules.items()
+        }
+        self.ttl = ttl
+        self.path = Path(path or MIRROR_RANKING_PATH)
+        self.rankings: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.read()
+
+    def read(self):
+        try:
+            self.rankings = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            log.debug(f"mirror ranking broken: {e}")
+        return self
+
+    def save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.rankings))
+        except OSError as e:
+            log.debug(f"cannot save mirror ranking: {e}")
+
+    def rule_of(self, url: str) -> Optional[str]:
+        """
+        The longest prefix of `url` which has mirrors.
+        """
+        matched = [prefix for prefix in self.rules if url.startswith(prefix)]
+        return max(matched, key=len, default=None)
+
+    def candidates(
+        self, url: str, probe: Callable[[str], Optional[float]]
+    ) -> list[str]:
+        """
+        `url` rewritten to every mirror, the fastest healthy first.
+        The mirrors are probed with `probe(url) -> seconds or None if unhealthy` if the
+        ranking is outdated.
+        """
+        prefix = self.rule_of(url)
+        if prefix is None:
+            return [url]
+        with self.lock:
+            ranking = self.rankings.get(prefix)
+            if (
+                ranking is None
+                or time.time() - ranking["time"] > self.ttl
+                or set(ranking["mirrors"]) != set(self.rules[prefix])
+            ):
+                ranking = self.rank(prefix, url, probe)
+        return [mirror + url[len(prefix) :] for mirror in ranking["mirrors"]]
+
+    def rank(
+        self, prefix: str, url: str, probe: Callable[[str], Optional[float]]
+    ) -> dict:
+        mirrors = self.rules[prefix]
+        with ThreadPoolExecutor(max_workers=len(mirrors)) as pool:
+            scores = list(
+                pool.map(lambda m: probe(m + url[len(prefix) :]), mirrors)
+            )
+        # unhealthy mirrors are kept at the end, as the last resort
+        order = sorted(
+            range(len(mirrors)),
+            key=lambda i: (scores[i] is None, scores[i] or 0),
+        )
+        for i in order:
+            log.debug(
+                f"mirror {mirrors[i]}: "
+                + (f"{scores[i]:.3f}s" if scores[i] is not None else "unhealthy")
+            )
+        ranking = self.rankings[prefix] = {
+            "time": time.time(),
+            "mirrors": [mirrors[i] for i in order],
+        }
+        self.save()
+        return ranking
+
+    def failed(self, url: str):
+        """
+        A request to a mirror failed: use it last for the rest of the run.
+        """
+        with self.lock:
+            for ranking in self.rankings.values():
+                for mirror in ranking["mirrors"]:
+                    if url.startswith(mirror):
+                        log.warning(f"mirror {mirror} failed, trying the next one.")
+                        ranking["mirrors"].remove(mirror)
+                        ranking["mirrors"].append(mirror)
+                        return
+
+
+def measure(get: Callable[..., requests.Response], url: str) -> Optional[float]:
+    """
+    Seconds to download the first `PROBE_SIZE` bytes of `url` through `get`,
+    `None` if it fails.
+    """
+    start = time.monotonic()
+    try:
+        with get(url, headers={"Range": f"bytes=0-{PROBE_SIZE - 1}"}, stream=True) as r:
+            if r.status_code >= 400:
+                return None
+            got = 0
+            for chunk in r.iter_content(8192):
+                got += len(chunk)
+                if got >= PROBE_SIZE:
+                    break
+    except (requests.RequestException, ConnectionError) as e:
+        log.debug(f"probing {url} failed: {e}")
+        return None
+    return time.monotonic() - start
+
+
+@functools.lru_cache()
+def mirrors() -> Mirrors:
+    """
+    The mirrors of the `mirrors` config.
+    """
+    return Mirrors(get_config("mirrors"), ttl=float(get_config("mirror_ttl")))
@@ -0,0 +1,201 @@
+"""
+Pacing of github api requests. A token bucket spaces them out, and the quota reported in
+the `X-RateLimit-*` headers is tracked for every github token, so a request switches to
+another token, or waits for the reset, instead of failing with 403.
+"""
+
+import functools
+import logging as log
+import os
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+
+from ..utils.config import get_config
+from ..utils.exceptions import RateLimitError
+
+RATE_LIMIT_URL = "https://api.github.com/rate_limit"
+# statuses github answers when a quota is used up
+LIMITED_STATUS = (403, 429)
+
+
+class TokenBucket:
+    """
+    Allows `rate` units per second on average, and bursts of up to `capacity` units.
+    `rate <= 0` means unlimited. Shared by threads.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, n: float = 1) -> float:
+        """
+        Take `n` units, blocking until they are available. `n` may exceed `capacity`.
+
+        `Returns`: seconds waited.
+        """
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            # reserve the units now, so waiting threads are served in order
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class Quota:
+    def __init__(self, limit: int, remaining: int, reset: float):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset  # unix time
+
+    def __str__(self) -> str:
+        return "{}/{}, resets at {}".format(
+            self.remaining,
+            self.limit,
+            time.strftime("%H:%M:%S", time.localtime(self.reset)),
+        )
+
+
+def github_tokens() -> list[str]:
+    """
+    Github tokens from the `GITHUB_TOKEN` env var (comma separated) or the `github_token`
+    config (a string or a list).
+    """
+    tokens = os.environ.get("GITHUB_TOKEN") or get_config("github_token") or []
+    if isinstance(tokens, str):
+        tokens = tokens.split(",")
+    return [t.strip() for t in tokens if t.strip()]
+
+
+def resource_of(url: str) -> Optional[str]:
+    """
+    The rate limit resource a request counts against, `None` if it's free.
+
+    >>> resource_of("https://api.github.com/search/repositories")
+    'search'
+    """
+    path = urlparse(url).path
+    if path.startswith("/rate_limit"):
+        return None
+    if path.startswith("/search/"):
+        return "search"
+    if path.startswith("/graphql"):
+        return "graphql"
+    return "core"
+
+
+def mask(token: Optional[str]) -> str:
+    return f"token ...{token[-4:]}" if token else "anonymous"
+
+
+class RateLimiter:
+    """
+    Hands out github tokens for api requests. The token with the most quota left is
+    used; if every token is used up, the request waits until the earliest reset, at
+    most `max_wait` seconds.
+    """
+
+    def __init__(
+        self, tokens: list[str], rate: float = 0, max_wait: float = float("inf")
+    ):
+        # anonymous requests when no token is configured
+        self.tokens: list[Optional[str]] = list(tokens) or [None]
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(rate)
+        self.quotas: dict[tuple[Optional[str], str], Quota] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, resource: str, token_required: bool = False) -> Optional[str]:
+        """
+        Wait for the pacing and the quota of `resource`, then pick a token.
+
+        Raises `RateLimitError` if the quota resets later than `max_wait`.
+        """
+        self.bucket.take()
+        while True:
+            with self.lock:
+                now = time.time()
+                candidates = [t for t in self.tokens if t or not token_required]
+                if not candidates:
+                    return None
+                available = []
+                for i, token in enumerate(candidates):
+                    quota = self.quotas.get((token, resource))
+                    if quota is None or quota.reset <= now:
+                        available.append((float("inf"), -i, token, None))
+                    elif quota.remaining > 0:
+                        available.append((quota.remaining, -i, token, quota))
+                if available:
+                    *_, token, quota = max(available, key=lambda x: x[:2])
+                    if quota:
+                        # reserve one, the response headers correct it later
+                        quota.remaining -= 1
+                    return token
+                reset = min(self.quotas[(t, resource)].reset for t in candidates)
+            wait = reset - now
+            if wait > self.max_wait:
+                raise RateLimitError(resource, reset)
+            log.warning(
+                f"github api rate limit of `{resource}` exceeded, waiting {wait:.0f}s until it resets..."
+            )
+            time.sleep(wait)
+
+    def update(
+        self, token: Optional[str], resource: str, response: requests.Response
+    ) -> bool:
+        """
+        Record the quota reported by a response.
+
+        `Returns`: whether the request was rejected by the rate limit and should be retried.
+        """
+        headers = response.headers
+        quota = None
+        with self.lock:
+            if "X-RateLimit-Remaining" in headers:
+                resource = headers.get("X-RateLimit-Resource", resource)
+                quota = self.quotas[(token, resource)] = Quota(
+                    int(headers.get("X-RateLimit-Limit", 0)),
+                    int(headers["X-RateLimit-Remaining"]),
+                    float(headers.get("X-RateLimit-Reset", 0)),
+                )
+            if response.status_code not in LIMITED_STATUS:
+                return False
+            if "Retry-After" in headers:
+                # secondary rate limit: pause this token for a while
+                reset = time.time() + float(headers["Retry-After"])
+                quota = self.quotas[(token, resource)] = Quota(
+                    quota.limit if quota else 0, 0, reset
+                )
+                return True
+            return quota is not None and quota.remaining == 0
+
+    def record(self, token: Optional[str], resource: str, quota: Quota):
+        with self.lock:
+            self.quotas[(token, resource)] = quota
+
+
+@functools.lru_cache()
+def limiter() -> RateLimiter:
+    """
+    The limiter of all github api requests, with the configured tokens.
+    """
+    return RateLimiter(
+        github_tokens(),
+        rate=float(get_config("api_rate")),
+        max_wait=float(get_config("rate_limit_wait")),
+    )
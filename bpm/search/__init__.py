@@ -4,17 +4,14 @@ import logging as log
 import posixpath
 import sys
 import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import suppress
 from functools import reduce
 from pprint import pprint
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 from urllib.parse import urljoin, urlparse
 
-import questionary
-import questionary.question
-import requests
-from pretty_assert import assert_not_in
-
+from ..utils.config import get_config
 from ..utils.constants import INFO_BASE_STRING, OPTION_REPO_NUM, WINDOWS
 from ..utils.exceptions import AssetNotFoundError, RepoNotFoundError
 from ..utils.input import user_interrupt
@@ -35,9 +32,15 @@ class RepoHandler:
         self.prefer_gnu: bool = False
         self.no_pre: bool = False
         self.one_bin: bool = False
+        # sha256 of the installed asset
+        self.sha256: Optional[str] = None
+        # sha256 published in the release of `asset`, set by `get_asset`
+        self.expected_sha256: Optional[str] = None
 
         self.set(**kwargs)
         if WINDOWS:
+            from pretty_assert import assert_not_in
+
             assert_not_in(
                 name,
                 ("app", "bin"),
@@ -57,6 +60,7 @@ class RepoHandler:
         "prefer_gnu",
         "no_pre",
         "one_bin",
+        "sha256",
     ]
 
     def to_dict(self) -> dict:
@@ -94,6 +98,10 @@ class RepoHandler:
         self.__dict__.update(state)
         if "asset_filter" not in state:
             self.asset_filter = []
+        if "sha256" not in state:
+            self.sha256 = None
+        if "expected_sha256" not in state:
+            self.expected_sha256 = None
 
     def set(self, **kwargs):
         for k, v in kwargs.items():
@@ -172,6 +180,8 @@ class RepoHandler:
         `sort`: sort the search result. Use best-match by default.
             More info: https://docs.github.com/rest/search/search?apiVersion=2022-11-28#search-repositories
         """
+        from .. import net
+
         params = {
             "q": f"{self.name} in:name",
             "page": page,
@@ -179,9 +189,10 @@ class RepoHandler:
         }
         if sort:
             params["sort"] = sort
-        r = requests.get(
+        r = net.get_cached(
             urljoin(self.api_base, posixpath.join("search", "repositories")),
             params=params,
+            ttl=float(get_config("search_ttl")),
         )
 
         if r.status_code == 200:
@@ -198,15 +209,33 @@ class RepoHandler:
         """
         ask what repo to install.
         please call `search()` before ask.
+
+        Pages are kept while asking, and the next page is fetched in the background
+        while the user reads the current one.
         """
+        pages: dict[int, Future] = {}
+        pool = ThreadPoolExecutor(max_workers=1)
+
+        def fetch_page(page: int) -> Future:
+            if page not in pages:
+                pages[page] = pool.submit(self.search, page, sort)
+            return pages[page]
+
+        try:
+            return self._ask(fetch_page, quiet)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _ask(self, fetch_page: Callable[[int], Future], quiet: bool):
         page = 1
         while True:
-            repo_selections = self.search(page, sort)
+            repo_selections = fetch_page(page).result()
             if not repo_selections:
                 raise RepoNotFoundError
             if quiet:
                 log.info(f"auto select repo: {repo_selections[0]}")
                 return self.set_by_url(repo_selections[0])
+            fetch_page(page + 1)
             for i, item in enumerate(repo_selections):
                 print(f"{i + 1}: {item}")
             try:
@@ -219,7 +248,7 @@ class RepoHandler:
                     page += 1
                     continue
                 elif temp == "p":
-                    page -= 1
+                    page = max(page - 1, 1)
                     continue
                 return self.set_by_url(repo_selections[int(temp) - 1])
             except IndexError:
@@ -232,31 +261,53 @@ class RepoHandler:
                 print("Invalid input: please input a valid number.", file=sys.stderr)
                 exit(1)
 
-    def get_asset(self, interactive: bool = False):
+    def get_releases(self) -> list[dict]:
         """
-        get version and filter out which asset link to download
+        get the releases of the repo from the REST api, newest first.
         """
+        from .. import net
+
         assert self.url is not None, "use ask() before get_asset"
         api = urljoin(
             self.api_base,
             posixpath.join("repos", self.repo_owner, self.repo_name, "releases"),  # type: ignore
         )
 
-        r: list = requests.get(api).json()
+        r = net.get_cached(api)
         log.debug(f"asset api: {api}")
-        if not isinstance(r, list):
+        if r.status_code == 404:
             log.error(f"repo {self.repo_owner}/{self.repo_name} not found.")
             raise RepoNotFoundError
+        # e.g. 403 when the rate limit is exceeded, which is not a missing repo
+        r.raise_for_status()
+        return r.json()
+
+    def get_asset(
+        self, interactive: bool = False, releases: Optional[list[dict]] = None
+    ):
+        """
+        get version and filter out which asset link to download
 
-        r = list(filter(lambda x: bool(x["assets"]), r))
+        `releases`: releases in the REST api format, e.g. from a batched graphql query.
+            Fetched from the REST api if not given.
+        """
+        from .checksum import published_sha256
+
+        if releases is None:
+            releases = self.get_releases()
+        r = list(filter(lambda x: bool(x["assets"]), releases))
         if len(r) == 0:
             raise AssetNotFoundError
 
         self.version = r[0]["tag_name"]
         assets: list[str] = [x["browser_download_url"] for x in r[0]["assets"]]
+        release_assets = assets
 
         if interactive:
+            import questionary
+
             self.asset = questionary.select("please choose an asset:", assets).ask()
+            self.expected_sha256 = published_sha256(self.asset, release_assets)
             return self
 
         # user filter
@@ -272,7 +323,7 @@ class RepoHandler:
 
         # sort by package type
         # Note that BPM only support .tar.??, .zip and  .7z package type.
-        temp = [".tar", ".tar.gz", ".tar.xz", ".tar.bz2", ".zip", ".7z"]
+        temp = [".tar", ".tar.gz", ".tar.xz", ".tar.bz2", ".tar.zst", ".zip", ".7z"]
         if WINDOWS:
             temp.extend((".exe", ".msi"))
         assets = sort_list(
@@ -284,19 +335,23 @@ class RepoHandler:
 
         self.asset = assets[0]
         log.info(f"selected asset: {self.asset}")
+        self.expected_sha256 = published_sha256(self.asset, release_assets)
         return self
 
-    def update_asset(self) -> Optional[Union[tuple[str, str], tuple[None, None]]]:
+    def update_asset(
+        self, releases: Optional[list[dict]] = None
+    ) -> Optional[Union[tuple[str, str], tuple[None, None]]]:
         """
         update assets list. If a repo was installed locally, it will always return (None, None).
 
+        `releases`: see `get_asset`.
         `Returns`: `None` if has no update, `(old_version, new_version)` if has update.
         """
         assert self.version
         old_version = self.version
         if not old_version:
             return None, None
-        self.get_asset()
+        self.get_asset(releases=releases)
         if old_version == self.version:
             return None
         return (old_version, self.version)
@@ -0,0 +1,77 @@
+"""
+Find the published sha256 of an asset in the checksum files of its release.
+"""
+
+import logging as log
+import re
+from typing import Optional
+
+import requests
+
+from .. import net
+
+# files listing the checksums of all assets of a release
+SUMS_FILE_PATTERN = re.compile(
+    r"(^|[-_.])(sha256sums|checksums)(\.txt)?$", re.IGNORECASE
+)
+SHA256_PATTERN = re.compile(r"^[0-9a-fA-F]{64}$")
+
+
+def name_of(url: str) -> str:
+    return url.strip("/").rpartition("/")[-1]
+
+
+def checksum_assets(asset: str, assets: list[str]) -> list[tuple[str, bool]]:
+    """
+    The checksum files of `asset` in its release, the most specific first, with whether
+    the file is only for `asset`.
+
+    >>> checksum_assets("a/x.tar.gz", ["a/x.tar.gz", "a/SHA256SUMS", "a/x.tar.gz.sha256"])
+    [('a/x.tar.gz.sha256', True), ('a/SHA256SUMS', False)]
+    """
+    name = name_of(asset).lower()
+    own = [
+        (a, True)
+        for a in assets
+        if name_of(a).lower() in (name + ".sha256", name + ".sha256sum")
+    ]
+    sums = [(a, False) for a in assets if SUMS_FILE_PATTERN.search(name_of(a))]
+    return own + sums
+
+
+def parse_checksum(text: str, name: str, own: bool = False) -> Optional[str]:
+    """
+    Find the sha256 of file `name` in a checksum file: lines of `<hash>  <name>`
+    (`sha256sum` format, `*<name>` in binary mode), or a single hash if the file is
+    `own` by `name`.
+
+    >>> parse_checksum("ab" * 32 + "  x.zip\\n" + "cd" * 32 + " *y.zip", "y.zip")
+    'cdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcdcd'
+    """
+    lines = [line.split() for line in text.splitlines() if line.strip()]
+    if own and len(lines) == 1 and SHA256_PATTERN.match(lines[0][0]):
+        return lines[0][0].lower()
+    for line in lines:
+        if len(line) >= 2 and SHA256_PATTERN.match(line[0]):
+            if name_of(line[-1].lstrip("*")) == name:
+                return line[0].lower()
+    return None
+
+
+def published_sha256(asset: str, assets: list[str]) -> Optional[str]:
+    """
+    The sha256 of `asset` published in the checksum files of its release, `None` if
+    there is none.
+    """
+    name = name_of(asset)
+    for url, own in checksum_assets(asset, assets):
+        try:
+            r = net.get(url, "download")
+            r.raise_for_status()
+        except (requests.RequestException, ConnectionError) as e:
+            log.warning(f"cannot get checksum file {url}: {e}")
+            continue
+        if digest := parse_checksum(r.text, name, own):
+            log.info(f"found sha256 of {name} in {name_of(url)}")
+            return digest
+    return None
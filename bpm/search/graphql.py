@@ -0,0 +1,107 @@
+"""
+Batched release queries through the github graphql api: one request checks dozens of
+repos instead of one REST request per repo. Graphql needs a token, without one the
+REST api is used.
+"""
+
+import json
+import logging as log
+from typing import Iterable, Optional
+
+import requests
+
+from .. import net
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+# repos per query. 50 repos * 10 releases * 100 assets stays far below the node limit.
+BATCH_SIZE = 50
+RELEASE_NUM = 10
+
+RELEASES_FIELDS = f"""releases(first: {RELEASE_NUM}, orderBy: {{field: CREATED_AT, direction: DESC}}) {{
+      nodes {{ tagName releaseAssets(first: 100) {{ nodes {{ downloadUrl }} }} }}
+    }}"""
+
+
+def build_query(repos: list[tuple[str, str]]) -> str:
+    """
+    One query for all `(owner, name)`, the repo at index `i` is aliased as `r{i}`.
+
+    >>> print(build_query([("a", "b")]).splitlines()[1])
+      r0: repository(owner: "a", name: "b") {
+    """
+    parts = [
+        f"  r{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{\n"
+        f"    {RELEASES_FIELDS}\n"
+        "  }"
+        for i, (owner, name) in enumerate(repos)
+    ]
+    return "query {\n" + "\n".join(parts) + "\n}"
+
+
+def to_rest_releases(repository: dict) -> list[dict]:
+    """
+    Convert the releases of a graphql `repository` to the REST api format, so the asset
+    selection runs on them unchanged.
+    """
+    return [
+        {
+            "tag_name": release["tagName"],
+            "assets": [
+                {"browser_download_url": asset["downloadUrl"]}
+                for asset in release["releaseAssets"]["nodes"]
+            ],
+        }
+        for release in repository["releases"]["nodes"]
+    ]
+
+
+def query_releases(
+    repos: list[tuple[str, str]], endpoint: str = GRAPHQL_URL
+) -> list[Optional[list[dict]]]:
+    """
+    Query the latest releases of `(owner, name)` repos in one request.
+    The token is added by the rate limiter.
+
+    `Returns`: releases in the REST format for every repo, `None` for the repos github
+        could not resolve (e.g. not found).
+    """
+    r = net.request("POST", endpoint, json={"query": build_query(repos)})
+    r.raise_for_status()
+    body = r.json()
+    for error in body.get("errors") or []:
+        log.debug(f"graphql error: {error.get('message')}")
+    data = body.get("data")
+    if data is None:
+        raise ValueError("graphql query returned no data")
+    return [
+        to_rest_releases(data[f"r{i}"]) if data.get(f"r{i}") else None
+        for i in range(len(repos))
+    ]
+
+
+def batch_releases(repos: Iterable, endpoint: str = GRAPHQL_URL) -> dict[str, list[dict]]:
+    """
+    Latest releases of `RepoHandler`s, queried in batches of `BATCH_SIZE`.
+
+    `Returns`: `{repo name: releases}`. Repos missing in it (no token, query failed,
+        repo not resolved) have to be checked through the REST api.
+    """
+    repos = [r for r in repos if r.site == "github" and r.repo_owner and r.repo_name]
+    if not net.github_tokens() or not repos:
+        return {}
+
+    result = {}
+    for i in range(0, len(repos), BATCH_SIZE):
+        batch = repos[i : i + BATCH_SIZE]
+        try:
+            releases = query_releases(
+                [(r.repo_owner, r.repo_name) for r in batch], endpoint
+            )
+        except (requests.RequestException, ConnectionError, ValueError, KeyError) as e:
+            log.warning(f"batched update check failed, use the REST api instead: {e}")
+            break
+        result.update(
+            (repo.name, r) for repo, r in zip(batch, releases) if r is not None
+        )
+    log.debug(f"checked {len(result)} of {len(repos)} repos in batches")
+    return result
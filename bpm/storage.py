@@ -2,44 +2,221 @@ import bisect
 import json
 import logging as log
 import pickle
+import sqlite3
+import threading
 from pathlib import Path
 from pprint import pprint
 from typing import Optional, Union
 
-from pretty_assert import assert_
-
 from .search import RepoHandler
+from .utils.config import get_config
 from .utils.constants import DATABASE_PATH, INFO_BASE_STRING, OLD_DATABASE_PATH, WINDOWS
 from .utils.exceptions import RepoNotFoundError
 
 
-class RepoGroup:
-    def __init__(self, db_path=DATABASE_PATH):
-        self.repos: list[RepoHandler] = []
-        self.db_path = db_path
-        # read config once in the init of RepoGroup.
-        self.read()
+class JsonStore:
+    """
+    All repos in one json file, rewritten on every change.
+    """
 
-    def read(self):
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def load(self) -> list[RepoHandler]:
         try:
             try:
-                self.repos = list(
-                    map(RepoHandler.from_dict, json.loads(self.db_path.read_text()))
+                return list(
+                    map(RepoHandler.from_dict, json.loads(self.path.read_text()))
                 )
             except (json.JSONDecodeError, UnicodeDecodeError, FileNotFoundError):
                 log.info("fallback to pickle")
-                self.repos = pickle.loads(OLD_DATABASE_PATH.read_bytes())
+                return pickle.loads(OLD_DATABASE_PATH.read_bytes())
         except FileNotFoundError:
             log.warning("database not found. use a clean database instead.")
+        return []
+
+    def save(
+        self,
+        repos: list[RepoHandler],
+        changed: Optional[dict[str, Optional[RepoHandler]]] = None,
+    ):
+        log.info(f"save db to {self.path}")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # write a new file and rename it, a crash never leaves a half-written database
+        temp = self.path.with_name(self.path.name + ".tmp")
+        temp.write_text(json.dumps(list(map(lambda x: x.to_dict(), repos))))
+        temp.replace(self.path)
+
+
+class SqliteStore:
+    """
+    Repos in a sqlite database in WAL mode, a row per repo and per installed file.
+    A change writes only the rows of the changed repos, in one transaction.
+    The json (or pickle) database is imported when the sqlite one is created.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS packages (
+            name TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS installed_files (
+            package TEXT NOT NULL REFERENCES packages(name) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (package, seq)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS installed_files_path ON installed_files(path);
+    """
+
+    def __init__(self, path: Path, legacy: Optional[JsonStore] = None):
+        self.path = Path(path)
+        self.legacy = legacy
+        self.conn: Optional[sqlite3.Connection] = None
+        # what the database holds: name -> (data, installed files)
+        self.rows: dict[str, tuple[str, list[str]]] = {}
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            new = not self.path.exists()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # autocommit, transactions are begun explicitly
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.executescript(self.SCHEMA)
+            self.conn = conn
+            if new and self.legacy and (repos := self.legacy.load()):
+                log.info(f"migrating {len(repos)} repos from {self.legacy.path}")
+                self.save(repos)
+        return self.conn
+
+    @staticmethod
+    def split(repo: RepoHandler) -> tuple[str, list[str]]:
+        data = repo.to_dict()
+        files = data.pop("installed_files")
+        return json.dumps(data), list(files)
+
+    def load(self) -> list[RepoHandler]:
+        try:
+            conn = self.connect()
+        except (OSError, sqlite3.Error) as e:
+            # e.g. not root
+            log.warning(f"cannot open {self.path}: {e}")
+            return self.legacy.load() if self.legacy else []
+        files: dict[str, list[str]] = {}
+        for package, path in conn.execute(
+            "SELECT package, path FROM installed_files ORDER BY package, seq"
+        ):
+            files.setdefault(package, []).append(path)
+        repos = []
+        self.rows = {}
+        rows = conn.execute("SELECT name, data FROM packages ORDER BY name")
+        for name, data in rows:
+            installed = files.get(name, [])
+            # a copy, the repo's list is changed in place
+            self.rows[name] = (data, list(installed))
+            repo = RepoHandler.from_dict(json.loads(data) | {"name": name})
+            repo.installed_files = installed
+            repos.append(repo)
+        return repos
+
+    def save(
+        self,
+        repos: list[RepoHandler],
+        changed: Optional[dict[str, Optional[RepoHandler]]] = None,
+    ):
+        """
+        `changed`: The repos changed (`None` if removed) since the last save. All repos
+            are compared with the database if not given.
+        """
+        conn = self.connect()
+        if changed is None:
+            changed = {repo.name: repo for repo in repos}
+            changed.update({n: None for n in self.rows if n not in changed})
+        written: dict[str, Optional[tuple[str, list[str]]]] = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for name, repo in changed.items():
+                old = self.rows.get(name)
+                if repo is None:
+                    if old:
+                        # the files are removed by the cascade
+                        conn.execute("DELETE FROM packages WHERE name = ?", (name,))
+                        written[name] = None
+                    continue
+                data, files = self.split(repo)
+                if old is None or old[0] != data:
+                    conn.execute(
+                        "INSERT INTO packages (name, data) VALUES (?, ?) "
+                        "ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                        (name, data),
+                    )
+                if old is None or old[1] != files:
+                    conn.execute(
+                        "DELETE FROM installed_files WHERE package = ?", (name,)
+                    )
+                    conn.executemany(
+                        "INSERT INTO installed_files VALUES (?, ?, ?)",
+                        ((name, i, path) for i, path in enumerate(files)),
+                    )
+                if old != (data, files):
+                    written[name] = (data, files)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        log.info(f"saved {len(written)} repos to {self.path}")
+        for name, row in written.items():
+            if row is None:
+                del self.rows[name]
+            else:
+                self.rows[name] = row
+
+
+class RepoGroup:
+    def __init__(self, db_path=DATABASE_PATH, backend: Optional[str] = None):
+        self.db_path = Path(db_path)
+        self.backend = backend
+        # the store is opened and read on first use, not when bpm starts
+        self._store: Optional[Union[JsonStore, SqliteStore]] = None
+        self._repos: Optional[list[RepoHandler]] = None
+        self._lock = threading.RLock()
+
+    @property
+    def store(self) -> Union[JsonStore, SqliteStore]:
+        with self._lock:
+            if self._store is None:
+                backend = self.backend or get_config("database")
+                if backend == "sqlite":
+                    self._store = SqliteStore(
+                        self.db_path.with_suffix(".sqlite"),
+                        legacy=JsonStore(self.db_path),
+                    )
+                else:
+                    if backend != "json":
+                        log.warning(f"unknown database backend `{backend}`, use json.")
+                    self._store = JsonStore(self.db_path)
+            return self._store
+
+    @property
+    def repos(self) -> list[RepoHandler]:
+        with self._lock:
+            if self._repos is None:
+                self.read()
+            return self._repos  # type: ignore
+
+    @repos.setter
+    def repos(self, repos: list[RepoHandler]):
+        self._repos = repos
+
+    def read(self):
+        with self._lock:
+            self._repos = sorted(self.store.load())
         return self
 
     def save(self):
-        log.info(f"save db to {self.db_path}")
-        self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        # self.db_path.write_bytes(pickle.dumps(self.repos))
-        self.db_path.write_text(
-            json.dumps(list(map(lambda x: x.to_dict(), self.repos)))
-        )
+        self.store.save(self.repos)
 
     def info_repos(self):
         print(INFO_BASE_STRING.format("Name", "Url", "Version"))
@@ -78,7 +255,7 @@ class RepoGroup:
         """
         index = bisect.bisect_left(self.repos, repo)
         self.repos.insert(index, repo)
-        self.save()
+        self.store.save(self.repos, {repo.name: repo})
 
     def remove_repo(self, repo: Union[str, RepoHandler]) -> RepoHandler:
         """
@@ -87,7 +264,7 @@ class RepoGroup:
         index, result = self.find_repo(repo)
         if result:
             res = self.repos.pop(index)
-            self.save()
+            self.store.save(self.repos, {res.name: None})
             return res
         else:
             raise RepoNotFoundError(str(getattr(repo, "name", repo)))
@@ -100,6 +277,8 @@ class RepoGroup:
         """
         assert WINDOWS, "alias is not supported on non-Windows systems."
 
+        from pretty_assert import assert_
+
         # change three files: lnk, cmd, ""
         count = 0
         for repo in self.repos:
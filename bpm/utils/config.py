@@ -0,0 +1,77 @@
+"""
+User configuration, read from `CONF_PATH/config.json`.
+
+Every key is optional; missing keys fall back to `DEFAULT_CONFIG`.
+"""
+
+import functools
+import json
+import logging as log
+from typing import Any
+
+from .constants import CONFIG_PATH
+
+DEFAULT_CONFIG: dict[str, Any] = {
+    # downloads are kept in memory up to this size (bytes), then spooled to a temp file.
+    "spool_threshold": 16 * 1024 * 1024,
+    # extract tar archives while downloading them.
+    "stream_extract": True,
+    # number of concurrent connections for one download, 1 to disable.
+    "download_segments": 4,
+    # only assets larger than this (bytes) are downloaded in segments.
+    "segment_min_size": 8 * 1024 * 1024,
+    # max total size (bytes) of cached archives, 0 to disable the cache.
+    "cache_size": 1024 * 1024 * 1024,
+    # http timeouts (seconds): connecting, reading api responses, reading downloads.
+    "connect_timeout": 5,
+    "api_timeout": 15,
+    "download_timeout": 30,
+    # retries on connection errors and 5xx, waiting `http_backoff * 2 ** n` seconds in between.
+    "http_retries": 3,
+    "http_backoff": 0.5,
+    # cached api responses younger than this (seconds) are used without asking github.
+    "metadata_ttl": 60,
+    # the same, for repo search results, which change slowly.
+    "search_ttl": 600,
+    # mirrors of url prefixes, e.g. {"https://github.com/": ["https://mirror/github.com/"]}.
+    "mirrors": {},
+    # seconds until the mirrors are probed and ranked again.
+    "mirror_ttl": 3600,
+    # max total download bandwidth (bytes per second, or e.g. "2M"), 0 for unlimited.
+    "limit_rate": 0,
+    # packages searched, downloaded and extracted at the same time.
+    "jobs": 4,
+    # decompress with multithreaded commands (`xz -T0`, `pigz`, `zstd`) if found.
+    "external_decoders": True,
+    # files of a package installed at the same time.
+    "install_threads": 8,
+    # where installed packages are recorded: "json" (db.json) or "sqlite" (db.sqlite,
+    # imported from db.json on first use).
+    "database": "json",
+    # github tokens (a string or a list), requests rotate between them.
+    # `GITHUB_TOKEN` env var (comma separated) takes precedence.
+    "github_token": "",
+    # github api requests per second, 0 for no pacing.
+    "api_rate": 10,
+    # max seconds to wait for the github api quota to reset, instead of failing.
+    "rate_limit_wait": 3600,
+}
+
+
+@functools.lru_cache()
+def load_config() -> dict[str, Any]:
+    """
+    Read the config file once and merge it onto the defaults.
+    """
+    config = DEFAULT_CONFIG.copy()
+    try:
+        config.update(json.loads(CONFIG_PATH.read_text()))
+    except FileNotFoundError:
+        pass
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        log.warning(f"invalid config file `{CONFIG_PATH}`: {e}. Use default config.")
+    return config
+
+
+def get_config(key: str) -> Any:
+    return load_config()[key]
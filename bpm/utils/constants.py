@@ -15,6 +15,12 @@ else:
 
 OLD_DATABASE_PATH = CONF_PATH / "bpm.db"
 DATABASE_PATH = CONF_PATH / "db.json"
+CONFIG_PATH = CONF_PATH / "config.json"
+DOWNLOAD_PATH = CONF_PATH / "downloads"  # partial downloads, for resuming
+CACHE_PATH = CONF_PATH / "cache"  # downloaded archives
+METADATA_CACHE_PATH = CONF_PATH / "http-cache"  # github api responses
+MIRROR_RANKING_PATH = CONF_PATH / "mirrors.json"  # mirrors sorted by speed
+STAGING_PATH = CONF_PATH / "staging"  # packages extracted for installing
 INFO_BASE_STRING = "{:20} {:50} {:20}"
 OPTION_REPO_NUM = 7  # the number of repos to select in asking
 
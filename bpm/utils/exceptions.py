@@ -1,3 +1,6 @@
+import time
+
+
 class RepoNotFoundError(FileNotFoundError):
     def __init__(self, repo=""):
         super().__init__(
@@ -30,6 +33,55 @@ class TarPathTraversalException(Exception):
         super().__init__(message)
 
 
+class RangeNotSupportedError(Exception):
+    """
+    The server ignored a Range request.
+    """
+
+    def __init__(self, url: str = ""):
+        super().__init__(f"Server does not support range requests: {url}")
+
+
+class IncompleteDownloadError(IOError):
+    def __init__(self, url: str = "", got: int = 0, expected: int = 0):
+        super().__init__(
+            f"Download incomplete: got {got} of {expected} bytes from {url}. Retry to resume."
+        )
+
+
+class ChecksumMismatchError(Exception):
+    """
+    The downloaded asset does not match the checksum published in its release.
+    """
+
+    def __init__(self, name: str = "", expected: str = "", actual: str = ""):
+        super().__init__(
+            f"Checksum mismatch of {name}: expected sha256 {expected}, got {actual}. The download is broken or tampered with."
+        )
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    Too many recent failures of a host, requests to it are paused.
+    """
+
+    def __init__(self, host: str = ""):
+        super().__init__(
+            f"Requests to {host} are paused after repeated failures. Retry later."
+        )
+
+
+class RateLimitError(ConnectionError):
+    """
+    The github api quota is used up, and resets too late to wait for it.
+    """
+
+    def __init__(self, resource: str = "core", reset: float = 0):
+        super().__init__(
+            f"GitHub api rate limit of `{resource}` exceeded, it resets at {time.strftime('%H:%M:%S', time.localtime(reset))}. Configure `github_token` for a higher limit."
+        )
+
+
 class LnkNotFoundError(FileNotFoundError):
     def __init__(self, lnk_name: str = ""):
         super().__init__(
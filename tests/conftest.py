@@ -0,0 +1,111 @@
+import io
+import re
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+import bpm.install as install
+import bpm.install.cache as cache
+import bpm.install.download as download
+import bpm.net.metadata as metadata
+import bpm.net.mirror as mirror
+import bpm.net.ratelimit as ratelimit
+
+ASSETS_PATH = Path(__file__).parent.parent / "test_assets"
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class RangeHandler(QuietHandler):
+    """
+    Static file handler with single `bytes=start-end` range support.
+    """
+
+    def send_head(self):
+        path = Path(self.translate_path(self.path))
+        if not path.is_file():
+            return super().send_head()
+        data = path.read_bytes()
+        start, end = 0, len(data) - 1
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match[1])
+            end = min(int(match[2]), end) if match[2] else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        return io.BytesIO(data[start : end + 1])
+
+
+@pytest.fixture(autouse=True)
+def conf_path(monkeypatch, tmp_path):
+    """
+    Keep partial downloads, the caches and the staging dir in a temp dir instead of
+    `CONF_PATH`, and use a fresh rate limiter, mirror ranking and bandwidth limit for
+    every test.
+    """
+    monkeypatch.setattr(download, "DOWNLOAD_PATH", tmp_path / "downloads")
+    monkeypatch.setattr(cache, "CACHE_PATH", tmp_path / "cache")
+    monkeypatch.setattr(metadata, "METADATA_CACHE_PATH", tmp_path / "http-cache")
+    monkeypatch.setattr(mirror, "MIRROR_RANKING_PATH", tmp_path / "mirrors.json")
+    monkeypatch.setattr(install, "STAGING_PATH", tmp_path / "staging")
+    cache.open_cache.cache_clear()
+    metadata.open_metadata_cache.cache_clear()
+    ratelimit.limiter.cache_clear()
+    mirror.mirrors.cache_clear()
+    download.bandwidth.cache_clear()
+    yield tmp_path
+    cache.open_cache.cache_clear()
+    metadata.open_metadata_cache.cache_clear()
+    ratelimit.limiter.cache_clear()
+    mirror.mirrors.cache_clear()
+    download.bandwidth.cache_clear()
+
+
+@pytest.fixture
+def serve_dir():
+    """
+    Factory serving a directory on a local http server. Returns the base url.
+    """
+    servers = []
+
+    def serve(directory, ranges: bool = True) -> str:
+        handler = RangeHandler if ranges else QuietHandler
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), partial(handler, directory=str(directory))
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def http_server(serve_dir):
+    """
+    Serve `test_assets` without range support. Returns the base url.
+    """
+    return serve_dir(ASSETS_PATH, ranges=False)
+
+
+@pytest.fixture
+def range_server(serve_dir):
+    """
+    Serve `test_assets` with range support. Returns the base url.
+    """
+    return serve_dir(ASSETS_PATH)
@@ -0,0 +1,63 @@
+import io
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from pretty_assert import assert_, assert_eq
+
+from bpm.install import download_and_extract
+from bpm.install.cache import DownloadCache, open_cache
+
+ASSETS_PATH = Path(".") / "test_assets"
+
+
+class TestCache:
+    def test_put_get(self):
+        with TemporaryDirectory() as tmp_dir:
+            cache = DownloadCache(Path(tmp_dir), max_size=1024)
+            blob = cache.put_fileobj("http://a/x.tar.gz", io.BytesIO(b"hello"))
+            assert_eq(blob.read_bytes(), b"hello")
+            # same content from another url shares the archive
+            cache.put_fileobj("http://b/y.tar.gz", io.BytesIO(b"hello"))
+            assert_eq(cache.total_size, 5)
+            assert_eq(cache.get("http://a/x.tar.gz"), blob)
+            assert_eq(cache.get("http://c/z.tar.gz"), None)
+            assert_eq(cache.stats["hits"], 1)
+            assert_eq(cache.stats["misses"], 1)
+            assert_eq(cache.stats["bytes_saved"], 5)
+            # persisted
+            cache = DownloadCache(Path(tmp_dir), max_size=1024)
+            assert_eq(cache.find("y.tar.gz"), blob)
+            assert_eq(cache.find(blob.name[:8]), blob)
+            assert_(cache.name_of(blob) in ("x.tar.gz", "y.tar.gz"))
+
+    def test_lru_eviction(self):
+        with TemporaryDirectory() as tmp_dir:
+            cache = DownloadCache(Path(tmp_dir), max_size=250)
+            cache.put_fileobj("a", io.BytesIO(b"a" * 100))
+            cache.put_fileobj("b", io.BytesIO(b"b" * 100))
+            cache.get("a")  # `b` is the least recently used now
+            cache.put_fileobj("c", io.BytesIO(b"c" * 100))
+            assert_eq(sorted(cache.entries), ["a", "c"])
+            assert_eq(len(list(cache.blob_path.glob("*"))), 2)
+            # a file larger than the cache is kept until the next one
+            cache.put_fileobj("d", io.BytesIO(b"d" * 300))
+            assert_eq(sorted(cache.entries), ["d"])
+
+    def test_download_and_extract_cached(self, http_server):
+        url = f"{http_server}/root.tar.gz"
+        with TemporaryDirectory() as tmp_dir:
+            download_and_extract(url, Path(tmp_dir))
+        cache = open_cache()
+        assert_(cache is not None)
+        assert_eq(cache.stats["misses"], 1)  # type: ignore
+        # served from the cache
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            main = download_and_extract(url, tmp_dir)
+            assert_eq(main, tmp_dir / "root")
+            assert_((main / "1").exists())
+        assert_eq(cache.stats["hits"], 1)  # type: ignore
+        assert_eq(
+            cache.stats["bytes_saved"],  # type: ignore
+            (ASSETS_PATH / "root.tar.gz").stat().st_size,
+        )
@@ -0,0 +1,86 @@
+import hashlib
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+from pretty_assert import assert_, assert_eq
+
+from bpm.install import download_and_extract
+from bpm.install.cache import open_cache
+from bpm.install.download import Checksum
+from bpm.search.checksum import published_sha256
+from bpm.utils.config import load_config
+from bpm.utils.exceptions import ChecksumMismatchError
+
+ASSETS_PATH = Path(".") / "test_assets"
+
+
+def sha256(name: str) -> str:
+    return hashlib.sha256((ASSETS_PATH / name).read_bytes()).hexdigest()
+
+
+@pytest.fixture(params=["stream", "spool", "partial"])
+def download_path(request, monkeypatch):
+    """
+    Run the test through every download path of `download_and_extract`.
+    """
+    if request.param == "spool":
+        monkeypatch.setitem(load_config(), "stream_extract", False)
+    if request.param == "partial":
+        monkeypatch.setitem(load_config(), "spool_threshold", 0)
+        monkeypatch.setitem(load_config(), "segment_min_size", 0)
+    return request.param
+
+
+class TestChecksum:
+    @pytest.mark.parametrize("name", ["root.tar.gz", "noroot.zip"])
+    def test_verified(self, range_server, download_path, name):
+        checksum = Checksum(name, sha256(name))
+        with TemporaryDirectory() as tmp_dir:
+            download_and_extract(f"{range_server}/{name}", Path(tmp_dir), checksum)
+        assert_eq(checksum.digest, sha256(name))
+        # the cache hit is verified by the archive name, without reading it
+        checksum = Checksum(name, sha256(name))
+        with TemporaryDirectory() as tmp_dir:
+            download_and_extract(f"{range_server}/{name}", Path(tmp_dir), checksum)
+        assert_eq(open_cache().stats["hits"], 1)
+
+    @pytest.mark.parametrize("name", ["root.tar.gz", "noroot.zip"])
+    def test_mismatch(self, range_server, download_path, name):
+        with TemporaryDirectory() as tmp_dir:
+            with pytest.raises(ChecksumMismatchError):
+                download_and_extract(
+                    f"{range_server}/{name}", Path(tmp_dir), Checksum(name, "0" * 64)
+                )
+            if not name.endswith(".tar.gz") or download_path != "stream":
+                # verified before extracting
+                assert_eq(list(Path(tmp_dir).iterdir()), [])
+        # a broken download is neither cached nor kept for resuming
+        assert_eq(open_cache().entries, {})
+        assert_eq(list(Path(tmp_dir).parent.glob("downloads/*")), [])
+
+    def test_published_sha256(self, serve_dir):
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            digest = sha256("root.tar.gz")
+            (tmp_dir / "SHA256SUMS").write_text(
+                f"{'0' * 64}  other.tar.gz\n{digest} *root.tar.gz\n"
+            )
+            (tmp_dir / "other.zip.sha256").write_text("1" * 64)
+            url = serve_dir(tmp_dir)
+            assets = [
+                f"{url}/root.tar.gz",
+                f"{url}/other.zip.sha256",
+                f"{url}/SHA256SUMS",
+            ]
+            assert_eq(published_sha256(assets[0], assets), digest)
+            assert_eq(published_sha256(f"{url}/none.zip", assets), None)
+
+    def test_own_checksum_file(self, serve_dir):
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            (tmp_dir / "x.zip.sha256").write_text("AB" * 32 + "\n")
+            url = serve_dir(tmp_dir)
+            assets = [f"{url}/x.zip", f"{url}/x.zip.sha256"]
+            assert_eq(published_sha256(assets[0], assets), "ab" * 32)
+            assert_(published_sha256(assets[0], assets[:1]) is None)
@@ -0,0 +1,84 @@
+import threading
+from pathlib import Path
+
+import pytest
+from pretty_assert import assert_, assert_eq
+
+import bpm.command as command
+import bpm.install
+from bpm.cli import parser
+from bpm.search import RepoHandler
+from bpm.storage import RepoGroup
+
+ASSETS = {"a": "root.tar.gz", "b": "noroot.tar.gz", "c": "noroot.zip"}
+# the latest version of every package, `v1` by default
+VERSIONS = {"b": "v0"}
+
+
+@pytest.fixture
+def fake_install(monkeypatch, tmp_path, http_server):
+    """
+    Resolve `https://github.com/owner/<name>` to a local asset, and record installs
+    instead of touching the system. Returns the list of installed
+    `(name, installed in main thread, extracted files)`.
+    """
+    installed = []
+
+    def get_asset(self, interactive=False, releases=None):
+        self.version = VERSIONS.get(self.name, "v1")
+        self.asset = f"{http_server}/{ASSETS.get(self.name, 'missing.tar.gz')}"
+        return self
+
+    def auto_install(repo, main_path, rename=True):
+        files = sorted(p.name for p in Path(main_path).rglob("*"))
+        installed.append(
+            (repo.name, threading.current_thread() is threading.main_thread(), files)
+        )
+
+    monkeypatch.setattr(RepoHandler, "get_asset", get_asset)
+    monkeypatch.setattr(bpm.install, "auto_install", auto_install)
+    monkeypatch.setattr(command, "check_root", lambda: None)
+    monkeypatch.setattr(command, "repo_group", RepoGroup(db_path=tmp_path / "db.json"))
+    return installed
+
+
+def install_args(*names: str, jobs: int = 3):
+    return parser.parse_args(
+        ["install", *(f"https://github.com/owner/{n}" for n in names), "-j", str(jobs)]
+    )
+
+
+class TestCommand:
+    def test_parallel_install(self, fake_install):
+        args = install_args("a", "b", "c")
+        args.func(args)
+        # installed one by one in the main thread, in the order of arguments
+        assert_eq([x[0] for x in fake_install], ["a", "b", "c"])
+        assert_(all(x[1] for x in fake_install))
+        assert_(all("1" in x[2] for x in fake_install))
+        assert_eq([r.name for r in command.repo_group.repos], ["a", "b", "c"])
+        # the digest of every downloaded asset is recorded
+        assert_(all(len(r.sha256) == 64 for r in command.repo_group.repos))
+
+    def test_parallel_install_failure(self, fake_install):
+        args = install_args("a", "missing", "c")
+        with pytest.raises(SystemExit):
+            args.func(args)
+        assert_eq([x[0] for x in fake_install], ["a"])
+        assert_eq([r.name for r in command.repo_group.repos], ["a"])
+
+    def test_parallel_update(self, fake_install):
+        for name in ("a", "b", "missing"):
+            command.repo_group.insert_repo(
+                RepoHandler(name, version="v0", asset=f"{name}-v0.tar.gz")
+            )
+        args = parser.parse_args(["update", "-j", "3"])
+        args.func(args)
+        # `b` has no update, `missing` fails to download
+        assert_eq([x[0] for x in fake_install], ["a"])
+        assert_(fake_install[0][1])
+        versions = {r.name: (r.version, r.asset) for r in command.repo_group.read().repos}
+        assert_eq(versions["a"][0], "v1")
+        assert_eq(versions["b"][0], "v0")
+        # a failed update keeps the old version, so it is retried next time
+        assert_eq(versions["missing"], ("v0", "missing-v0.tar.gz"))
@@ -0,0 +1,89 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+from pretty_assert import assert_, assert_eq
+
+from bpm.install.archive import extract, extract_tar_stream
+from bpm.install.decompress import decompressed, detect
+from bpm.install.download import stream_and_extract
+from bpm.utils.config import load_config
+
+DATA = b"hello world\n" * 10000
+
+
+def zstd(data: bytes) -> bytes:
+    return subprocess.run(["zstd", "-c"], input=data, capture_output=True).stdout
+
+
+COMPRESSORS = {
+    "gzip": gzip.compress,
+    "xz": lzma.compress,
+    "bzip2": bz2.compress,
+}
+
+
+class TestDecompress:
+    def test_detect(self):
+        for name, compress in COMPRESSORS.items():
+            assert_eq(detect(compress(b"x")[:6]).name, name)
+        assert_eq(detect(b"\x28\xb5\x2f\xfd\x00\x00").name, "zstd")
+        assert_eq(detect(b"plain"), None)
+
+    @pytest.mark.parametrize("external", [True, False])
+    def test_decompressed(self, monkeypatch, external):
+        monkeypatch.setitem(load_config(), "external_decoders", external)
+        for compress in COMPRESSORS.values():
+            with decompressed(io.BytesIO(compress(DATA))) as stream:
+                assert_eq(stream.read(), DATA)
+        # not compressed, passed through
+        with decompressed(io.BytesIO(DATA)) as stream:
+            assert_eq(stream.read(), DATA)
+
+    @pytest.mark.skipif(not shutil.which("xz"), reason="no xz")
+    def test_external_error(self):
+        data = lzma.compress(DATA)
+        with pytest.raises(OSError):
+            with decompressed(io.BytesIO(data[: len(data) // 2])) as stream:
+                stream.read()
+
+    @pytest.mark.skipif(not shutil.which("xz"), reason="no xz")
+    def test_stream_abort(self, tmp_path):
+        tar = io.BytesIO()
+        with tarfile.open(fileobj=tar, mode="w") as file:
+            info = tarfile.TarInfo("big")
+            info.size = 4 * 1024 * 1024
+            file.addfile(info, io.BytesIO(os.urandom(info.size)))
+        data = lzma.compress(tar.getvalue())
+
+        def chunks():
+            yield data[: len(data) // 2]
+            raise ConnectionError("connection lost")
+
+        # the download error is reported, not the truncated archive
+        with pytest.raises(ConnectionError):
+            stream_and_extract(chunks(), tmp_path, extract_tar_stream)
+
+    @pytest.mark.skipif(not shutil.which("zstd"), reason="no zstd")
+    def test_tar_zst(self, tmp_path, monkeypatch):
+        tar = io.BytesIO()
+        with tarfile.open(fileobj=tar, mode="w") as file:
+            info = tarfile.TarInfo("pkg/bin")
+            info.size = len(DATA)
+            file.addfile(info, io.BytesIO(DATA))
+        main = extract(io.BytesIO(zstd(tar.getvalue())), tmp_path / "a", "pkg.tar.zst")
+        assert_eq((main / "bin").read_bytes(), DATA)
+
+        # without the zstd command, python < 3.14 cannot decompress it
+        monkeypatch.setitem(load_config(), "external_decoders", False)
+        try:
+            import compression.zstd  # type: ignore # noqa: F401
+        except ImportError:
+            with pytest.raises(SystemExit):
+                extract(io.BytesIO(zstd(tar.getvalue())), tmp_path / "b", "a.tar.zst")
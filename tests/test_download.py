@@ -0,0 +1,240 @@
+import io
+import os
+import tarfile
+import threading
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+from pretty_assert import assert_, assert_eq
+
+import bpm.install.download as download
+from bpm.install import download_and_extract, extract
+from bpm.install.archive import extract_tar_stream
+from bpm.install.download import (
+    PartialDownload,
+    RemoteInfo,
+    StreamPipe,
+    fetch,
+    iter_download,
+    parse_rate,
+    probe,
+    spooled_buffer,
+    stream_and_extract,
+)
+from bpm.utils.config import load_config
+
+ASSETS_PATH = Path(".") / "test_assets"
+
+
+@pytest.fixture
+def always_partial(monkeypatch):
+    """
+    Download every asset through `PartialDownload`, in segments if possible.
+    """
+    monkeypatch.setitem(load_config(), "spool_threshold", 0)
+    monkeypatch.setitem(load_config(), "segment_min_size", 0)
+
+
+class TestDownload:
+    def test_spooled_buffer_rollover(self):
+        data = (ASSETS_PATH / "noroot.zip").read_bytes()
+        with spooled_buffer(threshold=16) as buffer, TemporaryDirectory() as tmp_dir:
+            buffer.write(data)
+            assert_(buffer._rolled)
+            buffer.seek(0)
+            main = extract(buffer, Path(tmp_dir), "noroot.zip")
+            assert_((main / "1").exists())
+
+    def test_fetch(self, http_server):
+        with spooled_buffer() as buffer:
+            size = fetch(f"{http_server}/root.tar.gz", buffer)
+            assert_eq(size, (ASSETS_PATH / "root.tar.gz").stat().st_size)
+            assert_(not buffer._rolled)
+
+    def test_download_and_extract(self, http_server):
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            main = download_and_extract(f"{http_server}/root.tar.gz", tmp_dir)
+            assert_eq(main, tmp_dir / "root")
+            assert_((main / "1").exists())
+
+    def test_stream_and_extract(self, http_server):
+        for name, main_name in (("root.tar.gz", "root"), ("noroot.tar.gz", "")):
+            with TemporaryDirectory() as tmp_dir:
+                tmp_dir = Path(tmp_dir)
+                main = stream_and_extract(
+                    iter_download(f"{http_server}/{name}"), tmp_dir, extract_tar_stream
+                )
+                assert_eq(main, tmp_dir / main_name)
+                assert_((main / "1").exists())
+
+    def test_stream_pipe(self):
+        pipe = StreamPipe(maxsize=4)
+        pipe.write(b"hello ")
+        pipe.write(b"world")
+        pipe.finish()
+        assert_eq(pipe.read(), b"hello world")
+
+    def test_stream_extract_traversal(self):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w:gz") as tar:
+            info = tarfile.TarInfo("../evil")
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"evil"))
+        data.seek(0)
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir) / "dst"
+            tmp_dir.mkdir()
+            with pytest.raises(SystemExit):
+                extract_tar_stream(data, tmp_dir)
+            assert_(not (tmp_dir.parent / "evil").exists())
+
+    def test_probe(self, http_server, range_server):
+        size = (ASSETS_PATH / "root.tar.gz").stat().st_size
+        assert_eq(probe(f"{range_server}/root.tar.gz").size, size)
+        assert_(probe(f"{range_server}/root.tar.gz").accept_ranges)
+        assert_(not probe(f"{http_server}/root.tar.gz").accept_ranges)
+
+    def test_segmented_download(self, serve_dir):
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            data = os.urandom(1024 * 1024 + 7)
+            (tmp_dir / "big.bin").write_bytes(data)
+            url = f"{serve_dir(tmp_dir)}/big.bin"
+            partial = PartialDownload(url, probe(url))
+            assert_eq(partial.download(segments=5).read_bytes(), data)
+            assert_eq(len(partial.segments), 5)
+
+    def test_segmented_fallback(self, serve_dir):
+        # the server does not support ranges, so a single stream is used
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            data = os.urandom(100 * 1024)
+            (tmp_dir / "big.bin").write_bytes(data)
+            url = f"{serve_dir(tmp_dir, ranges=False)}/big.bin"
+            partial = PartialDownload(url, RemoteInfo(len(data), True))
+            assert_eq(partial.download(segments=4).read_bytes(), data)
+
+    def test_resume(self, serve_dir):
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            data = os.urandom(256 * 1024)
+            (tmp_dir / "big.bin").write_bytes(data)
+            url = f"{serve_dir(tmp_dir)}/big.bin"
+            half = len(data) // 2
+
+            # simulate an interrupted download: first half done, filled with zeros
+            partial = PartialDownload(url, probe(url))
+            partial._prepare(2)
+            partial.segments[0][2] = half
+            partial.save_state()
+
+            # only the missing half is downloaded, the zeros are kept
+            partial = PartialDownload(url, probe(url))
+            assert_eq(partial.written, half)
+            result = partial.download(segments=2).read_bytes()
+            assert_eq(result[:half], bytes(half))
+            assert_eq(result[half:], data[half:])
+
+    def test_resume_stream(self, serve_dir):
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            data = os.urandom(256 * 1024)
+            (tmp_dir / "big.bin").write_bytes(data)
+            url = f"{serve_dir(tmp_dir)}/big.bin"
+            partial = PartialDownload(url, probe(url))
+            chunks = partial.iter_chunks()
+            got = next(chunks)
+            chunks.close()  # interrupted
+
+            partial = PartialDownload(url, probe(url))
+            assert_eq(partial.written, len(got))
+            assert_eq(b"".join(partial.iter_chunks()), data)
+
+    @pytest.mark.parametrize("ranges", [True, False])
+    def test_stream_segments(self, serve_dir, ranges):
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            data = os.urandom(256 * 1024 + 3)
+            (tmp_dir / "big.bin").write_bytes(data)
+            url = f"{serve_dir(tmp_dir, ranges=ranges)}/big.bin"
+            # without range support, a single stream is used
+            partial = PartialDownload(url, RemoteInfo(len(data), True))
+            assert_eq(b"".join(partial.iter_chunks(segments=4)), data)
+            assert_eq(len(partial.segments), 4 if ranges else 1)
+
+    @pytest.mark.parametrize("stream_extract", [True, False])
+    def test_segment_below_spool_threshold(self, serve_dir, monkeypatch, stream_extract):
+        # large enough to be segmented, small enough to be kept in memory otherwise
+        monkeypatch.setitem(load_config(), "spool_threshold", 512 * 1024)
+        monkeypatch.setitem(load_config(), "segment_min_size", 128 * 1024)
+        monkeypatch.setitem(load_config(), "download_segments", 4)
+        monkeypatch.setitem(load_config(), "stream_extract", stream_extract)
+        calls = []
+        fetch_segments = download.fetch_segments
+
+        def spy(url, path, segments, *args, **kwargs):
+            calls.append(len(segments))
+            return fetch_segments(url, path, segments, *args, **kwargs)
+
+        monkeypatch.setattr(download, "fetch_segments", spy)
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            data = os.urandom(256 * 1024)
+            with tarfile.open(tmp_dir / "mid.tar", "w") as tar:
+                member = tarfile.TarInfo("mid/1")
+                member.size = len(data)
+                tar.addfile(member, io.BytesIO(data))
+            to_dir = tmp_dir / "out"
+            to_dir.mkdir()
+            main = download_and_extract(f"{serve_dir(tmp_dir)}/mid.tar", to_dir)
+            assert_eq((main / "1").read_bytes(), data)
+        assert_eq(calls, [4])
+        assert_eq(list(download.DOWNLOAD_PATH.glob("*")), [])
+
+    @pytest.mark.parametrize("segments", [1, 4])
+    def test_download_and_extract_partial(
+        self, range_server, always_partial, monkeypatch, segments
+    ):
+        monkeypatch.setitem(load_config(), "download_segments", segments)
+        for name, main_name in (("noroot.zip", ""), ("root.tar.gz", "root")):
+            with TemporaryDirectory() as tmp_dir:
+                tmp_dir = Path(tmp_dir)
+                main = download_and_extract(f"{range_server}/{name}", tmp_dir)
+                assert_eq(main, tmp_dir / main_name)
+                assert_((main / "1").exists())
+        # nothing is kept after a successful install
+        assert_eq(list(download.DOWNLOAD_PATH.glob("*")), [])
+
+    def test_parse_rate(self):
+        assert_eq(parse_rate("500K"), 500 * 1024)
+        assert_eq(parse_rate("2mb"), 2 * 1024 * 1024)
+        assert_eq(parse_rate(1000), 1000)
+        with pytest.raises(ValueError):
+            parse_rate("fast")
+
+    def test_limit_rate(self, serve_dir, monkeypatch):
+        monkeypatch.setitem(load_config(), "limit_rate", "512K")
+        download.bandwidth.cache_clear()
+        with TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            (tmp_dir / "big.bin").write_bytes(os.urandom(256 * 1024))
+            url = f"{serve_dir(tmp_dir)}/big.bin"
+            sizes = []
+            threads = [
+                threading.Thread(
+                    target=lambda: sizes.append(fetch(url, io.BytesIO()))
+                )
+                for _ in range(2)
+            ]
+            start = time.monotonic()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.monotonic() - start
+        assert_eq(sizes, [256 * 1024] * 2)
+        # 512 KB in total at 512 KB/s, minus the initial burst of 128 KB
+        assert_(elapsed >= 0.7, f"too fast: {elapsed:.2f}s")
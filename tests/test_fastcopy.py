@@ -0,0 +1,67 @@
+import errno
+import os
+
+from pretty_assert import assert_, assert_eq
+
+from bpm.install import fastcopy
+from bpm.install.fastcopy import copy_file
+
+
+class TestFastCopy:
+    def test_copy(self, tmp_path):
+        src = tmp_path / "src"
+        src.write_bytes(b"x" * 100000)
+        os.utime(src, ns=(0, 10**9))
+        src.chmod(0o751)
+        dst = tmp_path / "dst"
+        assert_(copy_file(src, dst) != "rename")
+        assert_eq(dst.read_bytes(), src.read_bytes())
+        assert_eq(dst.stat().st_mtime_ns, 10**9)
+        assert_eq(dst.stat().st_mode & 0o777, 0o751)
+        assert_(src.exists())
+
+    def test_move(self, tmp_path):
+        src = tmp_path / "src"
+        src.write_text("moved")
+        inode = src.stat().st_ino
+        dst = tmp_path / "dst"
+        assert_eq(copy_file(src, dst, move=True), "rename")
+        assert_eq(dst.stat().st_ino, inode)
+        assert_(not src.exists())
+
+        # a symlink is copied, its target may be relative
+        link = tmp_path / "link"
+        link.symlink_to("dst")
+        assert_(copy_file(link, tmp_path / "copied", move=True) != "rename")
+        assert_(link.is_symlink())
+        assert_eq((tmp_path / "copied").read_text(), "moved")
+
+    def test_replace(self, tmp_path):
+        dst = tmp_path / "dst"
+        dst.write_text("old")
+        for move in [False, True]:
+            src = tmp_path / "src"
+            src.write_text(f"new {move}")
+            copy_file(src, dst, move=move, mode=0o700)
+            assert_eq(dst.read_text(), f"new {move}")
+            assert_eq(dst.stat().st_mode & 0o777, 0o700)
+        # no temp file is left
+        assert_eq(sorted(p.name for p in tmp_path.iterdir()), ["dst"])
+
+    def test_fallback(self, tmp_path, monkeypatch):
+        calls = []
+
+        def unsupported(src, dst):
+            calls.append(src)
+            raise OSError(errno.EOPNOTSUPP, "not supported")
+
+        monkeypatch.setattr(fastcopy, "_unsupported", {})
+        monkeypatch.setattr(fastcopy, "reflink", unsupported)
+        monkeypatch.setattr(fastcopy, "copy_range", unsupported)
+        for name in ["a", "b"]:
+            src = tmp_path / name
+            src.write_text(name)
+            assert_eq(copy_file(src, tmp_path / f"{name}.copy"), "copy")
+            assert_eq((tmp_path / f"{name}.copy").read_text(), name)
+        # the unsupported strategies are tried only for the first file
+        assert_eq(len(calls), 2)
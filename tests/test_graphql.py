@@ -0,0 +1,129 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from pretty_assert import assert_, assert_eq
+
+from bpm.search import RepoHandler
+from bpm.search import graphql
+from bpm.search.graphql import batch_releases
+
+ASSETS = [
+    "tool-aarch64-apple-darwin.tar.gz",
+    "tool-x86_64-unknown-linux-gnu.zip",
+    "tool-x86_64-unknown-linux-musl.tar.gz",
+]
+
+
+class GraphQLHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in of the github graphql endpoint, answering repository release queries
+    from `repos`: `{"owner/name": [(tag, [asset names])]}`.
+    """
+
+    repos: dict
+    queries: list
+
+    def do_POST(self):
+        if self.path != "/graphql":
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).queries.append((self.headers.get("Authorization"), body["query"]))
+        data, errors = {}, []
+        for alias, owner, name in re.findall(
+            r'(r\d+): repository\(owner: "([^"]*)", name: "([^"]*)"\)', body["query"]
+        ):
+            releases = self.repos.get(f"{owner}/{name}")
+            if releases is None:
+                data[alias] = None
+                errors.append({"message": f"Could not resolve {owner}/{name}"})
+                continue
+            data[alias] = {
+                "releases": {
+                    "nodes": [
+                        {
+                            "tagName": tag,
+                            "releaseAssets": {
+                                "nodes": [
+                                    {"downloadUrl": f"https://x/{owner}/{tag}/{a}"}
+                                    for a in assets
+                                ]
+                            },
+                        }
+                        for tag, assets in releases
+                    ]
+                }
+            }
+        response = json.dumps({"data": data, "errors": errors}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def graphql_server(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "secret")
+    handler = type(
+        "Handler",
+        (GraphQLHandler,),
+        {
+            "queries": [],
+            "repos": {
+                "o/a": [("v2", []), ("v1", ASSETS)],
+                "o/b": [("v3", ASSETS[:1])],
+            },
+        },
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield handler, f"http://127.0.0.1:{server.server_address[1]}/graphql"
+    server.shutdown()
+    server.server_close()
+
+
+def repo(name: str) -> RepoHandler:
+    return RepoHandler(name, repo_owner="o", repo_name=name, version="v0")
+
+
+class TestGraphQL:
+    def test_batch(self, graphql_server):
+        handler, url = graphql_server
+        result = batch_releases([repo("a"), repo("b"), repo("missing")], url)
+        # one query for all repos, the unresolved one is left to REST
+        assert_eq(len(handler.queries), 1)
+        assert_eq(handler.queries[0][0], "bearer secret")
+        assert_eq(sorted(result), ["a", "b"])
+        assert_eq(result["b"][0]["tag_name"], "v3")
+
+    def test_select_asset(self, graphql_server):
+        _, url = graphql_server
+        a = repo("a")
+        assert_eq(a.update_asset(batch_releases([a], url)["a"]), ("v0", "v1"))
+        # the release without assets is skipped, as in the REST api
+        assert_eq(a.version, "v1")
+        assert_(a.asset.endswith("tool-x86_64-unknown-linux-musl.tar.gz"))
+
+    def test_batch_size(self, graphql_server, monkeypatch):
+        handler, url = graphql_server
+        monkeypatch.setattr(graphql, "BATCH_SIZE", 2)
+        result = batch_releases([repo("a"), repo("b"), repo("a")], url)
+        assert_eq(len(handler.queries), 2)
+        assert_eq(sorted(result), ["a", "b"])
+
+    def test_no_token(self, graphql_server, monkeypatch):
+        handler, url = graphql_server
+        monkeypatch.delenv("GITHUB_TOKEN")
+        assert_eq(batch_releases([repo("a")], url), {})
+        assert_eq(handler.queries, [])
+
+    def test_query_failed(self, graphql_server):
+        _, url = graphql_server
+        assert_eq(batch_releases([repo("a")], url + "/404"), {})
@@ -0,0 +1,43 @@
+from pretty_assert import assert_, assert_eq
+
+from bpm.install.index import HEADER_SIZE, TreeIndex
+
+
+class TestTreeIndex:
+    def test_order(self, tmp_path):
+        (tmp_path / "a/b").mkdir(parents=True)
+        (tmp_path / "a/b/c").touch()
+        (tmp_path / "a/d").touch()
+        (tmp_path / "e").touch()
+        index = TreeIndex(tmp_path)
+        assert_eq(
+            sorted(index.entries, key=lambda p: p.relative_to(tmp_path).parts),
+            sorted(tmp_path.rglob("*"), key=lambda p: p.relative_to(tmp_path).parts),
+        )
+        # a dir comes before its content
+        for i, p in enumerate(index.entries):
+            assert_(all(q not in p.parents for q in index.entries[i:]))
+        assert_eq(set(index.children()), {tmp_path / "a", tmp_path / "e"})
+        assert_eq(
+            set(index.under(tmp_path / "a")),
+            {tmp_path / "a/b", tmp_path / "a/b/c", tmp_path / "a/d"},
+        )
+        assert_eq(index.match("c"), [tmp_path / "a/b/c"])
+        index.remove(tmp_path / "a/b")
+        assert_eq(set(index.under(tmp_path / "a")), {tmp_path / "a/d"})
+        assert_(not index.is_dir(tmp_path / "a/b"))
+
+    def test_sniff(self, tmp_path):
+        (tmp_path / "doc/tool").mkdir(parents=True)
+        (tmp_path / "tool").write_text("not a binary")
+        (tmp_path / "target").mkdir()
+        (tmp_path / "target/tool").write_bytes(b"\x7fELF" + b"\0" * 100)
+        # only the header is read
+        (tmp_path / "_tool").write_text("#compdef tool\n" + "x" * HEADER_SIZE * 10)
+        (tmp_path / "_other").write_text("x" * HEADER_SIZE + "zsh")
+        index = TreeIndex(tmp_path)
+        assert_eq(index.find_bin("tool"), tmp_path / "target/tool")
+        assert_eq(index.find_bin("missing"), None)
+        assert_(index.is_zsh_completion(tmp_path / "_tool"))
+        assert_(not index.is_zsh_completion(tmp_path / "_other"))
+        assert_eq(len(index.header(tmp_path / "_tool")), HEADER_SIZE)
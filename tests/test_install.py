@@ -1,20 +1,33 @@
+import functools
+import io
 import logging as log
+import os
+import tarfile
+import time
+import zipfile
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
+import pytest
 from pretty_assert import assert_, assert_eq
 
+import bpm.install
 import bpm.utils as utils
 from bpm.install import (
+    auto_install,
     download_and_extract,
     extract,
     install,
     install_on_linux,
     merge_dir,
+    remove_vanished,
     rename_old,
     rename_old_rev,
     restore,
+    staging_dir,
 )
+from bpm.search import RepoHandler
+from bpm.utils.config import load_config
 
 log.basicConfig(level=log.DEBUG)
 
@@ -68,6 +81,38 @@ class TestInstall:
             merge_dir(test1, test2, rename=False)
             assert_(not (test2 / "overwrite.old").exists())
 
+    def test_merge_dir_parallel(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(load_config(), "install_threads", 4)
+        src = tmp_path / "src"
+        for i in range(50):
+            (src / f"d{i % 5}/sub").mkdir(parents=True, exist_ok=True)
+            (src / f"d{i % 5}/sub/f{i}").write_text(str(i))
+        order = [str(tmp_path / "dst" / p.relative_to(src)) for p in src.rglob("*")]
+        recorder = []
+        merge_dir(src, tmp_path / "dst", recorder=recorder)
+        assert_eq(recorder, order)
+        assert_eq((tmp_path / "dst/d3/sub/f8").read_text(), "8")
+
+        # a failed file stops the merge, what was installed is recorded for rollback
+        install = bpm.install.install
+
+        def failing(_from, *args, **kwargs):
+            if _from.name == "f7":
+                raise OSError("disk full")
+            install(_from, *args, **kwargs)
+
+        monkeypatch.setattr(bpm.install, "install", failing)
+        recorder = []
+        try:
+            merge_dir(src, tmp_path / "dst2", recorder=recorder)
+            assert_(False, "should fail")
+        except OSError:
+            pass
+        assert_(str(tmp_path / "dst2/d2/sub/f7") not in recorder)
+        assert_(all(Path(f).exists() for f in recorder))
+        restore(recorder)
+        assert_eq(list((tmp_path / "dst2").rglob("*")), [])
+
     def test_extract(self):
         assets_path = Path(".") / "test_assets"
         with TemporaryDirectory() as tmp_dir:
@@ -89,6 +134,196 @@ class TestInstall:
                 assert_eq(main, tmp_dir)
                 assert_((main / "1").exists())
 
+    def test_install_unchanged(self, tmp_path):
+        src = tmp_path / "src"
+        dst = tmp_path / "dst"
+        src.write_text("same")
+        install(src, dst)
+        os.utime(dst, ns=(0, 0))
+        inode = dst.stat().st_ino
+        # same content with another mtime: compared by hash and kept
+        install(src, dst, rename=False, mode=0o755)
+        assert_eq(dst.stat().st_ino, inode)
+        assert_eq(dst.stat().st_mode & 0o777, 0o755)
+        src.write_text("diff")
+        install(src, dst, rename=False)
+        assert_eq(dst.read_text(), "diff")
+        assert_(not (tmp_path / "dst.old").exists())
+
+    def test_remove_vanished(self, tmp_path):
+        (tmp_path / "a/b").mkdir(parents=True)
+        (tmp_path / "a/b/gone").touch()
+        (tmp_path / "a/kept").touch()
+        (tmp_path / "other").mkdir()
+        (tmp_path / "other/foreign").touch()
+        old = [str(tmp_path / p) for p in ["a", "a/b", "a/b/gone", "a/kept", "other"]]
+        remove_vanished(old, [str(tmp_path / "a"), str(tmp_path / "a/kept")])
+        assert_(not (tmp_path / "a/b").exists())
+        assert_((tmp_path / "a/kept").exists())
+        # not empty, still used by others
+        assert_((tmp_path / "other/foreign").exists())
+
+    def test_update_delta(self, tmp_path, monkeypatch):
+        dst = tmp_path / "dst"
+        (dst / "usr/bin").mkdir(parents=True)
+        monkeypatch.setattr(
+            bpm.install,
+            "install_on_linux",
+            functools.partial(bpm.install.install_on_linux, pkgdst=dst),
+        )
+        repo = RepoHandler("pkg")
+        repo.bin_name = "pkg"
+
+        def release(version, files: dict[str, str]):
+            pkg = tmp_path / version
+            for name, content in files.items():
+                (pkg / name).parent.mkdir(parents=True, exist_ok=True)
+                (pkg / name).write_text(content)
+            return pkg
+
+        auto_install(
+            repo,
+            release("v1", {"pkg": "1", "share/doc/a": "a", "share/doc/b": "b"}),
+        )
+        doc = dst / "usr/share/doc"
+        inode = (doc / "a").stat().st_ino
+        auto_install(
+            repo,
+            release("v2", {"pkg": "2", "share/doc/a": "a", "share/c": "c"}),
+            rename=False,
+        )
+        assert_eq((dst / "usr/bin/pkg").read_text(), "2")
+        assert_eq((doc / "a").stat().st_ino, inode)
+        assert_(not (doc / "b").exists())
+        assert_eq(
+            sorted(repo.installed_files),
+            sorted(
+                str(p)
+                for p in [
+                    dst / "usr/bin/pkg",
+                    dst / "usr/share/doc",
+                    doc / "a",
+                    dst / "usr/share/c",
+                ]
+            ),
+        )
+
+    def test_staging_dir(self, tmp_path):
+        (tmp_path / "root/usr").mkdir(parents=True)
+        assert_eq(staging_dir(tmp_path / "root"), tmp_path / "staging")
+
+    def test_install_on_linux(self, tmp_path):
+        src = tmp_path / "src"
+        dst = tmp_path / "dst"
+        (dst / "usr/bin").mkdir(parents=True)
+        (dst / "usr/lib/systemd/system").mkdir(parents=True)
+        for name, content in {
+            "tool": "#!/bin/sh",
+            "man/man1/tool.1": "man",
+            "completions/tool.fish": "fish",
+            "completions/tool.bash": "bash",
+            "completions/_tool": "#compdef tool",
+            "completions/_other": "not a completion",
+            "tool.service": "[Unit]",
+        }.items():
+            (src / name).parent.mkdir(parents=True, exist_ok=True)
+            (src / name).write_text(content)
+        share = dst / "usr/share"
+        for shell in [
+            "fish/vendor_completions.d",
+            "bash-completion/completions",
+            "zsh/site-functions",
+        ]:
+            (share / shell).mkdir(parents=True)
+        recorder = []
+        install_on_linux(src, "tool", recorder=recorder, pkgdst=dst)
+        for file in [
+            dst / "usr/bin/tool",
+            share / "man/man1/tool.1",
+            share / "fish/vendor_completions.d/tool.fish",
+            share / "bash-completion/completions/tool.bash",
+            share / "zsh/site-functions/_tool",
+            dst / "usr/lib/systemd/system/tool.service",
+        ]:
+            assert_(file.is_file(), file)
+            assert_(str(file) in recorder, file)
+        assert_(not (share / "zsh/site-functions/_other").exists())
+
+    def test_extract_zip(self, tmp_path):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr(zipfile.ZipInfo("pkg/"), "")
+            for i in range(100):
+                z.writestr(f"pkg/share/{i % 7}/file{i}", str(i) * 1000)
+            info = zipfile.ZipInfo("pkg/bin/tool", (2020, 1, 2, 3, 4, 6))
+            info.create_system = 3
+            info.external_attr = 0o100755 << 16
+            z.writestr(info, "#!/bin/sh")
+        data.seek(0)
+        main = extract(data, tmp_path / "dst", "pkg.zip")
+        assert_eq(main, tmp_path / "dst/pkg")
+        assert_eq((main / "share/3/file10").read_text(), "10" * 1000)
+        tool = main / "bin/tool"
+        assert_eq(tool.stat().st_mode & 0o777, 0o755)
+        assert_eq(time.localtime(tool.stat().st_mtime)[:6], (2020, 1, 2, 3, 4, 6))
+
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w") as z:
+            z.writestr("ok", "ok")
+            z.writestr("../evil", "evil")
+        data.seek(0)
+        with pytest.raises(SystemExit):
+            extract(data, tmp_path / "unsafe", "unsafe.zip")
+        assert_(not (tmp_path / "evil").exists())
+
+    def test_tar_safety(self, tmp_path):
+        def make_tar(*members: tarfile.TarInfo) -> io.BytesIO:
+            data = io.BytesIO()
+            with tarfile.open(fileobj=data, mode="w:xz") as tar:
+                for member in members:
+                    content = b"x" * member.size
+                    tar.addfile(member, io.BytesIO(content) if member.isreg() else None)
+            data.seek(0)
+            return data
+
+        def member(name, type=tarfile.REGTYPE, linkname="", size=0):
+            info = tarfile.TarInfo(name)
+            info.type, info.linkname, info.size = type, linkname, size
+            return info
+
+        safe = make_tar(
+            member("pkg", tarfile.DIRTYPE),
+            member("pkg/bin", size=3),
+            member("pkg/link", tarfile.SYMTYPE, "bin"),
+            member("pkg/hard", tarfile.LNKTYPE, "pkg/bin"),
+        )
+        main = extract(safe, tmp_path / "safe", "safe.tar.xz")
+        assert_eq(main, tmp_path / "safe/pkg")
+        assert_eq((main / "link").read_text(), "xxx")
+        assert_eq((main / "hard").stat().st_nlink, 2)
+
+        for i, members in enumerate(
+            [
+                [member("/abs")],
+                [member("a/../../up")],
+                [member("dev", tarfile.CHRTYPE)],
+                [member("link", tarfile.SYMTYPE, "../outside")],
+                [member("link", tarfile.SYMTYPE, "/etc")],
+                [member("hard", tarfile.LNKTYPE, "../outside")],
+                # `..` of a symlink is not its lexical parent
+                [
+                    member("dot", tarfile.SYMTYPE, "."),
+                    member("up", tarfile.SYMTYPE, "dot/.."),
+                ],
+                [member("dot", tarfile.SYMTYPE, "."), member("dot/../evil")],
+            ]
+        ):
+            to = tmp_path / f"unsafe{i}" / "dst"
+            to.mkdir(parents=True)
+            with pytest.raises(SystemExit):
+                extract(make_tar(*members), to, "unsafe.tar.xz")
+            assert_eq([p.name for p in to.parent.iterdir()], ["dst"])
+
     @utils.with_test
     def test_dry_run(self):
         with TemporaryDirectory() as tmp_dir:
@@ -0,0 +1,135 @@
+import json
+import socket
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+from pretty_assert import assert_, assert_eq
+
+from bpm import net
+from bpm.install import download_and_extract
+from bpm.net.mirror import Mirrors
+from bpm.utils.config import load_config
+
+ASSETS_PATH = Path(__file__).parent.parent / "test_assets"
+# nothing listens here
+ORIGIN = "http://github.invalid/"
+
+
+class AssetHandler(SimpleHTTPRequestHandler):
+    """
+    Serves `test_assets` after `delay` seconds, and records the `Authorization` headers.
+    """
+
+    delay = 0.0
+    tokens: list
+
+    def send_head(self):
+        type(self).tokens.append(self.headers.get("Authorization"))
+        time.sleep(self.delay)
+        return super().send_head()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def asset_server():
+    """
+    Factory of asset servers. Returns the handler class and the base url.
+    """
+    servers = []
+
+    def serve(delay: float = 0.0):
+        handler = type("Handler", (AssetHandler,), {"delay": delay, "tokens": []})
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), partial(handler, directory=str(ASSETS_PATH))
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return handler, f"http://127.0.0.1:{server.server_address[1]}/"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def dead_url() -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/"
+
+
+@pytest.fixture
+def use_mirrors(monkeypatch):
+    """
+    Set the mirrors of `ORIGIN`.
+    """
+    monkeypatch.setitem(load_config(), "http_retries", 0)
+
+    def use(*mirrors: str):
+        monkeypatch.setitem(load_config(), "mirrors", {ORIGIN: list(mirrors)})
+        net.mirrors.cache_clear()
+        net.breaker.reset()
+
+    yield use
+    net.breaker.reset()
+
+
+class TestMirror:
+    def test_rewrite(self, http_server, use_mirrors):
+        use_mirrors(dead_url(), f"{http_server}/")
+        response = net.get(f"{ORIGIN}root.tar.gz", "download")
+        assert_eq(response.content, (ASSETS_PATH / "root.tar.gz").read_bytes())
+        # the only healthy mirror is ranked first
+        assert_eq(net.mirrors().rankings[ORIGIN]["mirrors"][0], f"{http_server}/")
+
+    def test_rank_by_speed(self, asset_server, use_mirrors):
+        _, slow = asset_server(delay=0.3)
+        _, fast = asset_server()
+        use_mirrors(slow, fast)
+        assert_eq(
+            net.mirrors().candidates(f"{ORIGIN}root.tar.gz", net.probe_mirror),
+            [f"{fast}root.tar.gz", f"{slow}root.tar.gz", f"{ORIGIN}root.tar.gz"],
+        )
+        # the ranking is kept for the next run
+        net.mirrors.cache_clear()
+        assert_eq(net.mirrors().rankings[ORIGIN]["mirrors"][0], fast)
+
+    def test_failover(self, range_server, use_mirrors, conf_path):
+        dead = dead_url()
+        use_mirrors(dead, f"{range_server}/")
+        # a ranking from an earlier run, when the dead mirror was the fastest
+        (conf_path / "mirrors.json").write_text(
+            json.dumps(
+                {
+                    ORIGIN: {
+                        "time": time.time(),
+                        "mirrors": [dead, f"{range_server}/", ORIGIN],
+                    }
+                }
+            )
+        )
+        net.mirrors.cache_clear()
+        with TemporaryDirectory() as tmp_dir:
+            main = download_and_extract(f"{ORIGIN}root.tar.gz", Path(tmp_dir))
+            assert_((main / "1").exists())
+        # the dead mirror is used last for the rest of the run
+        assert_eq(net.mirrors().rankings[ORIGIN]["mirrors"][-1], dead)
+
+    def test_no_token_to_mirror(self, asset_server, use_mirrors):
+        handler, mirror = asset_server()
+        use_mirrors(mirror)
+        net.get(f"{ORIGIN}root.tar.gz", headers={"Authorization": "bearer secret"})
+        assert_eq(handler.tokens[-1], None)
+
+    def test_rule_of(self):
+        mirrors = Mirrors({"https://a/": ["https://b/"], "https://a/x/": []})
+        assert_eq(mirrors.rule_of("https://a/x/y"), "https://a/x/")
+        assert_eq(mirrors.rule_of("https://a/y"), "https://a/")
+        assert_eq(mirrors.rule_of("https://c/y"), None)
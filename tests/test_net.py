@@ -0,0 +1,169 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from pretty_assert import assert_, assert_eq
+
+from bpm import net
+from bpm.utils.config import load_config
+from bpm.utils.exceptions import CircuitOpenError
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    Answers 502 to the first `failures` requests, then 200.
+    """
+
+    protocol_version = "HTTP/1.1"
+    failures = 0
+    count = 0
+    clients: set
+
+    def do_GET(self):
+        type(self).count += 1
+        type(self).clients.add(self.client_address)
+        ok = type(self).count > type(self).failures
+        body = b"ok" if ok else b"bad gateway"
+        self.send_response(200 if ok else 502)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def flaky_server(monkeypatch):
+    monkeypatch.setitem(load_config(), "http_backoff", 0)
+    net.session.cache_clear()
+    net.breaker.reset()
+    handler = type("Handler", (FlakyHandler,), {"clients": set()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield handler, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    net.session.cache_clear()
+    net.breaker.reset()
+
+
+class TestNet:
+    def test_retry_on_5xx(self, flaky_server):
+        handler, url = flaky_server
+        handler.failures = 2
+        response = net.get(url)
+        assert_eq(response.status_code, 200)
+        assert_eq(handler.count, 3)
+
+    def test_give_up_after_retries(self, flaky_server):
+        handler, url = flaky_server
+        handler.failures = 100
+        response = net.get(url)
+        assert_eq(response.status_code, 502)
+        assert_eq(handler.count, int(load_config()["http_retries"]) + 1)
+
+    def test_keep_alive(self, flaky_server):
+        handler, url = flaky_server
+        for _ in range(3):
+            net.get(url)
+        # all requests are sent through one connection
+        assert_eq(len(handler.clients), 1)
+
+    def test_circuit_breaker(self, monkeypatch):
+        breaker = net.CircuitBreaker(threshold=2, cooldown=60)
+        breaker.failure("a")
+        breaker.check("a")
+        breaker.failure("a")
+        with pytest.raises(CircuitOpenError):
+            breaker.check("a")
+        breaker.check("b")
+        # half open after the cooldown: one trial only
+        breaker.cooldown = 0
+        breaker.check("a")
+        breaker.success("a")
+        breaker.check("a")
+        assert_("a" not in breaker.failures)
+
+    def test_circuit_opens_on_connection_errors(self, monkeypatch):
+        monkeypatch.setitem(load_config(), "http_retries", 0)
+        net.session.cache_clear()
+        net.breaker.reset()
+        url = "http://127.0.0.1:1/"
+        try:
+            for _ in range(net.breaker.threshold):
+                with pytest.raises(requests.ConnectionError):
+                    net.get(url)
+            with pytest.raises(CircuitOpenError):
+                net.get(url)
+        finally:
+            net.session.cache_clear()
+            net.breaker.reset()
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    """
+    Serves a fixed json body with an `ETag`, answers 304 to a matching `If-None-Match`.
+    """
+
+    body = b'[{"tag_name": "v1"}]'
+    etag = '"v1"'
+    requests: list
+
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == self.etag:
+            type(self).requests.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        type(self).requests.append(200)
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def etag_server():
+    handler = type("Handler", (ETagHandler,), {"requests": []})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield handler, f"http://127.0.0.1:{server.server_address[1]}/releases"
+    server.shutdown()
+    server.server_close()
+
+
+class TestMetadataCache:
+    def test_revalidate(self, etag_server, monkeypatch):
+        monkeypatch.setitem(load_config(), "metadata_ttl", 0)
+        handler, url = etag_server
+        first = net.get_cached(url, params={"page": 1})
+        second = net.get_cached(url, params={"page": 1})
+        assert_eq(handler.requests, [200, 304])
+        assert_eq(second.status_code, 200)
+        assert_eq(second.json(), first.json())
+        # other parameters are another request
+        net.get_cached(url, params={"page": 2})
+        assert_eq(handler.requests, [200, 304, 200])
+
+    def test_ttl(self, etag_server, monkeypatch):
+        monkeypatch.setitem(load_config(), "metadata_ttl", 3600)
+        handler, url = etag_server
+        net.get_cached(url)
+        assert_eq(net.get_cached(url).json(), [{"tag_name": "v1"}])
+        assert_eq(handler.requests, [200])
+
+    def test_changed(self, etag_server, monkeypatch):
+        monkeypatch.setitem(load_config(), "metadata_ttl", 0)
+        handler, url = etag_server
+        net.get_cached(url)
+        handler.body, handler.etag = b'[{"tag_name": "v2"}]', '"v2"'
+        assert_eq(net.get_cached(url).json(), [{"tag_name": "v2"}])
+        assert_eq(net.get_cached(url).json(), [{"tag_name": "v2"}])
+        assert_eq(handler.requests, [200, 200, 304])
@@ -0,0 +1,108 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from pretty_assert import assert_, assert_eq
+
+from bpm import net
+from bpm.net.ratelimit import TokenBucket
+from bpm.search import RepoHandler
+from bpm.utils.config import load_config
+from bpm.utils.exceptions import RateLimitError
+
+
+class QuotaHandler(BaseHTTPRequestHandler):
+    """
+    A github api stand-in allowing `quota` requests per token, reset `reset_after`
+    seconds after it is used up.
+    """
+
+    quota = 2
+    reset_after = 1.0
+    used: dict
+    reset: dict
+    requests: list
+
+    def do_GET(self):
+        cls = type(self)
+        token = self.headers.get("Authorization")
+        cls.requests.append(token)
+        now = time.time()
+        if cls.reset.get(token, now + 1) <= now:
+            cls.used[token] = 0
+        cls.reset.setdefault(token, now + 3600)
+        ok = cls.used.get(token, 0) < cls.quota
+        if ok:
+            cls.used[token] = cls.used.get(token, 0) + 1
+            if cls.used[token] == cls.quota:
+                cls.reset[token] = now + cls.reset_after
+        body = b"[]" if ok else b'{"message": "API rate limit exceeded"}'
+        self.send_response(200 if ok else 403)
+        self.send_header("X-RateLimit-Limit", str(cls.quota))
+        self.send_header("X-RateLimit-Remaining", str(cls.quota - cls.used.get(token, 0)))
+        self.send_header("X-RateLimit-Reset", str(cls.reset[token]))
+        self.send_header("X-RateLimit-Resource", "core")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def quota_server(monkeypatch):
+    monkeypatch.setitem(load_config(), "api_rate", 0)
+    monkeypatch.setitem(load_config(), "metadata_ttl", 0)
+    handler = type(
+        "Handler", (QuotaHandler,), {"used": {}, "reset": {}, "requests": []}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield handler, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+class TestRateLimit:
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=50, capacity=1)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.take()
+        # one burst, then 5 more at 50/s
+        assert_(time.monotonic() - start >= 0.09)
+
+    def test_rotate_tokens(self, quota_server, monkeypatch):
+        handler, url = quota_server
+        monkeypatch.setenv("GITHUB_TOKEN", "a,b")
+        for _ in range(4):
+            assert_eq(net.get(f"{url}/repos/o/r/releases").status_code, 200)
+        assert_eq(sorted(handler.requests), ["bearer a"] * 2 + ["bearer b"] * 2)
+
+    def test_wait_for_reset(self, quota_server):
+        handler, url = quota_server
+        for _ in range(3):
+            assert_eq(net.get(f"{url}/repos/o/r/releases").status_code, 200)
+        # the third request waited for the reset instead of failing
+        assert_eq(len(handler.requests), 3)
+
+    def test_wait_too_long(self, quota_server, monkeypatch):
+        handler, url = quota_server
+        handler.reset_after = 3600
+        monkeypatch.setitem(load_config(), "rate_limit_wait", 60)
+        for _ in range(2):
+            net.get(f"{url}/repos/o/r/releases")
+        with pytest.raises(RateLimitError):
+            net.get(f"{url}/repos/o/r/releases")
+
+    def test_rate_limit_is_not_missing_repo(self, quota_server, monkeypatch):
+        handler, url = quota_server
+        handler.quota = 0
+        monkeypatch.setitem(load_config(), "rate_limit_wait", 60)
+        monkeypatch.setattr(RepoHandler, "api_base", url)
+        repo = RepoHandler("r", repo_owner="o", repo_name="r")
+        # a 403 used to be reported as "repo not found"
+        with pytest.raises(RateLimitError):
+            repo.get_releases()
@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from pretty_assert import assert_eq
+
+from bpm.search import RepoHandler
+from bpm.utils.config import load_config
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in of the github repo search api, with repos `o/p{page}-{i}`.
+    """
+
+    pages: list
+
+    def do_GET(self):
+        page = int(parse_qs(urlparse(self.path).query)["page"][0])
+        type(self).pages.append(page)
+        items = [{"html_url": f"https://github.com/o/p{page}-{i}"} for i in range(3)]
+        body = json.dumps({"items": items}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def search_server(monkeypatch):
+    monkeypatch.setitem(load_config(), "api_rate", 0)
+    handler = type("Handler", (SearchHandler,), {"pages": []})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(
+        RepoHandler, "api_base", f"http://127.0.0.1:{server.server_address[1]}"
+    )
+    yield handler
+    server.shutdown()
+    server.server_close()
+
+
+def answer(monkeypatch, *inputs: Callable[[], str]):
+    it = iter(inputs)
+    monkeypatch.setattr("builtins.input", lambda _: next(it)())
+
+
+class TestSearch:
+    def test_ask_pages(self, search_server, monkeypatch):
+        def prefetched(page: int):
+            # the next page is fetched while the user reads this one
+            for _ in range(100):
+                if page in search_server.pages:
+                    return
+                time.sleep(0.02)
+            raise AssertionError(f"page {page} not prefetched")
+
+        answer(monkeypatch, lambda: prefetched(2) or "m", lambda: "p", lambda: "2")
+        repo = RepoHandler("foo").ask()
+        assert_eq(repo.url, "https://github.com/o/p1-1")
+        # going back does not fetch page 1 again
+        assert_eq(search_server.pages.count(1), 1)
+        assert_eq(search_server.pages.count(2), 1)
+
+    def test_search_cached(self, search_server, monkeypatch):
+        RepoHandler("foo").ask(quiet=True)
+        RepoHandler("foo").ask(quiet=True)
+        assert_eq(search_server.pages, [1])
+        # no reuse once expired
+        monkeypatch.setitem(load_config(), "search_ttl", 0)
+        monkeypatch.setitem(load_config(), "metadata_ttl", 0)
+        RepoHandler("foo").ask(quiet=True)
+        assert_eq(search_server.pages, [1, 1])
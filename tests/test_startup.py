@@ -0,0 +1,61 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from pretty_assert import assert_, assert_eq
+
+from bpm.storage import RepoGroup
+
+# modules only the subcommands needing them import
+HEAVY_MODULES = [
+    "requests",
+    "urllib3",
+    "tqdm",
+    "questionary",
+    "pretty_assert",
+    "pylnk3",
+]
+# cumulative import time of `bpm.cli` in microseconds, it was ~200ms with all of them
+IMPORT_BUDGET = 120_000
+
+
+def import_cli(code: str = "") -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import bpm.cli\n{code}"],
+        cwd=Path(__file__).parents[1],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def import_time(stderr: str, module: str) -> int:
+    """
+    The cumulative time of importing `module` from the `-X importtime` output.
+    """
+    for line in stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative)
+    raise AssertionError(f"{module} not imported")
+
+
+class TestStartup:
+    def test_no_heavy_imports(self):
+        code = f"import sys; print([m for m in {HEAVY_MODULES} if m in sys.modules])"
+        assert_eq(import_cli(code).stdout.strip(), "[]")
+
+    def test_import_budget(self):
+        # the fastest of a few runs, not to fail on a busy machine
+        spent = min(import_time(import_cli().stderr, "bpm.cli") for _ in range(3))
+        assert_(spent < IMPORT_BUDGET, f"importing bpm.cli took {spent}us")
+
+    def test_lazy_database(self, tmp_path):
+        code = "from bpm.storage import repo_group; print(repo_group._repos)"
+        assert_eq(import_cli(code).stdout.strip(), "None")
+
+        group = RepoGroup(db_path=tmp_path / "db.json", backend="sqlite")
+        assert_eq(list(tmp_path.iterdir()), [])
+        # opened on first use
+        assert_eq(group.repos, [])
+        assert_((tmp_path / "db.sqlite").exists())
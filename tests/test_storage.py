@@ -1,17 +1,21 @@
+import json
+import sqlite3
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
-from pretty_assert import assert_eq
+import pytest
+from pretty_assert import assert_, assert_eq
 
 from bpm.search import RepoHandler
 from bpm.storage import RepoGroup
 
 
 class TestStorage:
-    def test_repogroup_operations(self):
+    @pytest.mark.parametrize("backend", ["json", "sqlite"])
+    def test_repogroup_operations(self, backend):
         with TemporaryDirectory() as tmpdir:
             tmpdir = Path(tmpdir) / "repos.db"
-            test_group = RepoGroup(db_path=tmpdir)
+            test_group = RepoGroup(db_path=tmpdir, backend=backend)
             # insert, save
             test_group.insert_repo(RepoHandler("test_repo"))
             test_group.insert_repo(RepoHandler("abc"))
@@ -23,3 +27,53 @@ class TestStorage:
             # remove
             test_group.remove_repo("test_repo")
             assert_eq(["abc", "z"], [r.name for r in test_group.repos])
+
+    def test_sqlite(self, tmp_path):
+        group = RepoGroup(db_path=tmp_path / "db.json", backend="sqlite")
+        repo = RepoHandler("a").set(installed_files=["/usr/bin/a", "/usr/share/a"])
+        group.insert_repo(repo)
+        group.insert_repo(RepoHandler("b", version="1"))
+        repo.version = "2"
+        repo.installed_files.append("/usr/share/man/a.1")
+        group.save()
+
+        group = RepoGroup(db_path=tmp_path / "db.json", backend="sqlite")
+        a = group.find_repo("a")[1]
+        assert_eq(a.version, "2")
+        assert_eq(
+            a.installed_files, ["/usr/bin/a", "/usr/share/a", "/usr/share/man/a.1"]
+        )
+        group.remove_repo("a")
+
+        conn = sqlite3.connect(tmp_path / "db.sqlite")
+        assert_eq(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        assert_eq(conn.execute("SELECT name FROM packages").fetchall(), [("b",)])
+        # the files of a removed repo are removed as well
+        assert_eq(conn.execute("SELECT count(*) FROM installed_files").fetchone()[0], 0)
+
+    def test_sqlite_incremental(self, tmp_path):
+        group = RepoGroup(db_path=tmp_path / "db.json", backend="sqlite")
+        for name in "abc":
+            group.insert_repo(RepoHandler(name).set(installed_files=[f"/{name}"]))
+        statements = []
+        group.store.conn.set_trace_callback(statements.append)
+        group.find_repo("b")[1].version = "2"
+        group.save()
+        writes = [s for s in statements if s.startswith(("INSERT", "DELETE"))]
+        # only the changed row is written, its files are kept
+        assert_eq(len(writes), 1)
+        assert_("'b'" in writes[0])
+
+    def test_migration(self, tmp_path):
+        json_group = RepoGroup(db_path=tmp_path / "db.json", backend="json")
+        json_group.insert_repo(RepoHandler("a").set(installed_files=["/usr/bin/a"]))
+        assert_eq(json.loads((tmp_path / "db.json").read_text())[0]["name"], "a")
+        assert_(not (tmp_path / "db.json.tmp").exists())
+
+        group = RepoGroup(db_path=tmp_path / "db.json", backend="sqlite")
+        assert_eq([r.name for r in group.repos], ["a"])
+        assert_eq(group.repos[0].installed_files, ["/usr/bin/a"])
+        # imported once, later changes of db.json are not imported again
+        json_group.insert_repo(RepoHandler("b"))
+        group = RepoGroup(db_path=tmp_path / "db.json", backend="sqlite")
+        assert_eq([r.name for r in group.repos], ["a"])